@@ -0,0 +1,188 @@
+import os
+import json
+import hashlib
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from sklearn.metrics import mean_squared_error
+
+# where fitted forecasters are kept between runs (one file per training slice and hyperparameters) and the disk space
+# (in bytes) they may take at most; the least recently used fits are evicted beyond it
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../DataFiles', 'models')
+MODELS_BUDGET = 2**30
+
+
+def get_fit_key(x_train, y_train, x_val, y_val, x_eval, y_eval, params):
+    '''
+    The key of a fit: a digest of the training, validation and early stopping data (values and index), the
+    hyperparameters and the version of xgboost. Fits with the same key give the same model and predictions.
+    '''
+    digest = hashlib.blake2b(json.dumps([params, xgb.__version__], sort_keys=True, default=str).encode())
+    for data in [x_train, y_train, x_val, y_val, x_eval, y_eval]:
+        if data is None:
+            digest.update(b'none')
+            continue
+        digest.update(repr(list(data.columns) if isinstance(data, pd.DataFrame) else data.name).encode())
+        digest.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def fit_forecaster(x_train, y_train, x_val=None, y_val=None, x_eval=None, y_eval=None, params=None, n_threads=None, verbose=False):
+    '''
+    Fits an XGBRegressor with the given hyperparameters on the training data using at most n_threads threads (all
+    the cores by default) and returns the dictionary that plot_timeperformance takes for one series: x_train, y_train,
+    x_val, y_val, train_pred, val_pred and rmse (on the validation data; None without it) plus the fitted model.
+    If params has early_stopping_rounds, (x_eval, y_eval) is the evaluation set that stops it (the validation data
+    if not given).
+    '''
+    params = params or {}
+    model = xgb.XGBRegressor(**{**params, 'n_jobs': n_threads})
+    if 'early_stopping_rounds' in params:
+        eval_set = (x_eval, y_eval) if x_eval is not None else (x_val, y_val)
+        model.fit(x_train, y_train, eval_set=[(x_train, y_train), eval_set], verbose=verbose)
+    else:
+        model.fit(x_train, y_train)
+
+    result = {'model': model, 'x_train': x_train, 'y_train': y_train, 'x_val': x_val, 'y_val': y_val,
+              'train_pred': model.predict(x_train), 'val_pred': None, 'rmse': None}
+    if x_val is not None:
+        result['val_pred'] = model.predict(x_val)
+        result['rmse'] = np.sqrt(mean_squared_error(y_val, result['val_pred']))
+    return result
+
+
+def fit_forecaster_star(args):
+    '''
+    fit_forecaster for a tuple of its arguments (used by the processes of fit_forecasters).
+    '''
+    return fit_forecaster(*args)
+
+
+def get_fit_path(key, cache_dir=MODELS_DIR):
+    '''
+    The path of the cached result of the fit with the given key (see get_fit_key).
+    '''
+    return os.path.join(cache_dir, f'{key}.pkl')
+
+
+def evict_fits(cache_dir=MODELS_DIR, budget=MODELS_BUDGET):
+    '''
+    Deletes the least recently used fits in cache_dir (by modification time, which loading a fit refreshes) until the
+    rest take at most budget bytes.
+    '''
+    paths = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith('.pkl')]
+    paths.sort(key=os.path.getmtime, reverse=True)
+    total = 0
+    for path in paths:
+        total += os.path.getsize(path)
+        if total > budget:
+            os.remove(path)
+
+
+def fit_forecasters(tasks, params=None, n_jobs=None, cache_dir=MODELS_DIR, verbose=False):
+    '''
+    Fits one forecaster per task; tasks is a dictionary from a name (e.g., a language) to its
+    (x_train, y_train, x_val, y_val) optionally followed by the early stopping data (x_eval, y_eval) and the result is a dictionary from the name to the result of fit_forecaster.
+    Fits whose key (see get_fit_key) was fitted before are loaded from cache_dir (None to not cache); the rest are
+    fitted by n_jobs processes in parallel (all the cores by default), each using its share of the cores so that they
+    don't oversubscribe them. Only the model, the predictions and the rmse of a fit are cached (the data comes from
+    the task) and the cache is kept within MODELS_BUDGET (see evict_fits).
+    '''
+    params = params or {}
+    tasks = {name: tuple(task) + (None,) * (6 - len(task)) for name, task in tasks.items()}
+    keys = {name: get_fit_key(*task, params) for name, task in tasks.items()}
+    cached = {}
+    for name, key in keys.items():
+        path = get_fit_path(key, cache_dir) if cache_dir is not None else None
+        if path is not None and os.path.exists(path):
+            cached[name] = pd.read_pickle(path)
+            # mark it as recently used
+            os.utime(path)
+
+    stale = [name for name in tasks if name not in cached]
+    n_jobs = max(1, min(len(stale), n_jobs or os.cpu_count()))
+    n_threads = max(1, os.cpu_count() // n_jobs)
+    args = [(*tasks[name], params, n_threads, verbose) for name in stale]
+    if n_jobs > 1:
+        with Pool(n_jobs) as pool:
+            fitted = pool.map(fit_forecaster_star, args)
+    else:
+        fitted = [fit_forecaster(*arg) for arg in args]
+
+    if cache_dir is not None and stale:
+        os.makedirs(cache_dir, exist_ok=True)
+    for name, result in zip(stale, fitted):
+        cached[name] = {field: result[field] for field in ['model', 'train_pred', 'val_pred', 'rmse']}
+        if cache_dir is not None:
+            pd.to_pickle(cached[name], get_fit_path(keys[name], cache_dir))
+    if cache_dir is not None and stale:
+        evict_fits(cache_dir)
+
+    # in the order of the tasks, with their data
+    fields = ['x_train', 'y_train', 'x_val', 'y_val']
+    return {name: {**dict(zip(fields, tasks[name])), **cached[name]} for name in tasks}
+
+
+def get_cutoffs(num_months, n_folds=3, horizon=12):
+    '''
+    The rolling origins of a backtest over a series of num_months months: the position where the training data of
+    each fold ends. The training windows expand and the validation windows (the horizon months after each origin)
+    are consecutive and end with the series.
+    '''
+    cutoffs = [num_months - (n_folds - fold) * horizon for fold in range(n_folds)]
+    if cutoffs[0] < 1:
+        raise ValueError(f'A series of {num_months} months is too short for {n_folds} folds of {horizon} months')
+    return cutoffs
+
+
+def backtest(series, n_folds=3, horizon=12, params=None, n_jobs=None, cache_dir=MODELS_DIR):
+    '''
+    Backtests a forecaster on each series with expanding-window folds (see get_cutoffs); series is a dictionary from
+    a name to its features and target (x, y) ordered by time. The folds of all the series are fitted together by
+    fit_forecasters (in parallel and cached) from slices of the same feature matrices. If params has
+    early_stopping_rounds, the last horizon months of each training window are held out to stop it so that a fold is
+    never tuned on the months it's scored on. Returns a dictionary from the
+    name to the structure plot_timeperformance takes: the training data and predictions of the first fold, the
+    validation data and predictions of all the folds one after the other and the RMSE over all of them, plus the
+    RMSE of each fold (fold_rmse) and the first month of each validation window (cutoffs).
+    '''
+    params = params or {}
+    holdout = horizon if 'early_stopping_rounds' in params else 0
+    tasks = {}
+    for name, (x, y) in series.items():
+        for fold, cutoff in enumerate(get_cutoffs(len(x) - holdout, n_folds, horizon)):
+            # the origins are counted without the holdout so that every training window keeps at least a month
+            cutoff += holdout
+            val = slice(cutoff, cutoff + horizon)
+            if holdout:
+                tasks[(name, fold)] = (x.iloc[:cutoff - holdout], y.iloc[:cutoff - holdout], x.iloc[val], y.iloc[val],
+                                       x.iloc[cutoff - holdout:cutoff], y.iloc[cutoff - holdout:cutoff])
+            else:
+                tasks[(name, fold)] = (x.iloc[:cutoff], y.iloc[:cutoff], x.iloc[val], y.iloc[val])
+    fits = fit_forecasters(tasks, params, n_jobs, cache_dir)
+
+    results = {}
+    for name, (x, y) in series.items():
+        folds = [fits[(name, fold)] for fold in range(n_folds)]
+        y_val = pd.concat([fold['y_val'] for fold in folds])
+        val_pred = np.concatenate([fold['val_pred'] for fold in folds])
+        results[name] = {
+            'x_train': folds[0]['x_train'], 'y_train': folds[0]['y_train'], 'train_pred': folds[0]['train_pred'],
+            'x_val': pd.concat([fold['x_val'] for fold in folds]), 'y_val': y_val, 'val_pred': val_pred,
+            'rmse': np.sqrt(mean_squared_error(y_val, val_pred)),
+            'fold_rmse': [fold['rmse'] for fold in folds],
+            'cutoffs': [fold['x_val'].index[0] for fold in folds],
+        }
+    return results
+
+
+def get_backtest_table(results):
+    '''
+    Given the results of backtest, returns a dataframe with the RMSE of each fold (a column per fold) and over all
+    the folds (rmse) of each series and a last row with their averages over the series.
+    '''
+    table = pd.DataFrame({name: result['fold_rmse'] + [result['rmse']] for name, result in results.items()}).T
+    table.columns = [f'fold_{fold}' for fold in range(table.shape[1] - 1)] + ['rmse']
+    table.loc['average'] = table.mean()
+    return table
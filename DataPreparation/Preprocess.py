@@ -1,4 +1,5 @@
 import os
+import hashlib
 import matplotlib.pyplot as plt
 import itertools
 import pandas as pd
@@ -7,6 +8,13 @@ import seaborn as sns
 from IPython.display import display, HTML, Markdown, Latex
 import sys
 import ast
+import re
+from multiprocessing import Pool, shared_memory
+from collections import OrderedDict
+from scipy import sparse
+import pyarrow as pa
+import pyarrow.dataset
+import pyarrow.parquet as pq
 # sys.path.append('../')
 # from utils import nice_table
 sys.path.append('../')
@@ -15,80 +23,351 @@ from sklearn.experimental import enable_iterative_imputer
 from sklearn.impute import IterativeImputer
 from sklearn.preprocessing import StandardScaler
 from sklearn.linear_model import SGDRegressor
+from DataPreparation.Schema import apply_schema, get_kind, is_categorical, is_numerical
 
-def split_script():
+# bump whenever the typed content of the caches changes so that older caches get rebuilt
+CACHE_VERSION = 5
+
+# results of read_data kept in memory (least recently used first) and the memory (in bytes) they may take at most; it's
+# small as every call also gets a copy of the result (0 turns the memoization off)
+READ_CACHE = OrderedDict()
+READ_CACHE_BUDGET = 256 * 2**20
+
+# quartiles computed by get_quartiles (least recently used first) keyed by the columns and the digest of their values,
+# and the number of them kept at most
+QUARTILES_CACHE = OrderedDict()
+QUARTILES_CACHE_SIZE = 128
+
+# the dimensions and the summed measures of the aggregate cube (see build_cube)
+CUBE_DIMENSIONS = ['year', 'month', 'primaryLanguage', 'license', 'isArchived']
+CUBE_MEASURES = ['stars', 'forks', 'pullRequests', 'diskUsageKb']
+
+# the split of a repository is decided by a hash of its name so it never changes between runs or dataset refreshes
+SPLIT_HASH_KEY = 'github-metadata1'
+
+
+def get_split_names(names):
+    '''
+    Given a column of repository names (nameWithOwner), it assigns each to train, val or test with ratio 70:20:10
+    using a stable hash of the name.
     '''
-    Running this script will split the dataset into train, val, and test sets with ratio 70:20:10. For consistent 
-    results do not change the random state from 42.
+    # map each name to a stable number in [0, 1)
+    hashes = pd.util.hash_pandas_object(names.fillna('').astype(str), index=False, hash_key=SPLIT_HASH_KEY)
+    fractions = hashes.to_numpy() / 2**64
+    return np.select([fractions < .7, fractions < .9], ["train", "val"], "test")
+
+
+def split_script(chunksize=100_000):
     '''
-    # read the data
+    Running this script will split the dataset into train, val, and test sets with ratio 70:20:10 (and write train-val
+    as the union of train and val). The dataset is streamed in chunks of chunksize rows so memory stays bounded and
+    each repository goes to the split given by the hash of its name (see get_split_names) so the splits are identical
+    from run to run. The caches of the splits are built the first time they are read.
+    '''
+    # read the data chunk by chunk
     module_dir = os.path.dirname(__file__)
-    ds = pd.read_csv(os.path.join(module_dir, '../DataFiles/dataset.csv'))
+    chunks = pd.read_csv(os.path.join(module_dir, '../DataFiles/dataset.csv'), chunksize=chunksize)
+
+    # the splits each chunk is appended to
+    files = {split: open(get_split_path(split), 'w', newline='') for split in ["train", "val", "test", "train-val"]}
+    try:
+        for i, chunk in enumerate(chunks):
+            splits = get_split_names(chunk['nameWithOwner'])
+            for split in ["train", "val", "test"]:
+                chunk[splits == split].to_csv(files[split], header=(i == 0), index=False)
+            chunk[splits != "test"].to_csv(files["train-val"], header=(i == 0), index=False)
+    finally:
+        for file in files.values():
+            file.close()
+
+
+def get_split_path(split):
+    '''
+    Given the name of a split (train, val, train-val, test or all), returns the path of its csv file.
+    '''
+    module_dir = os.path.dirname(__file__)
+    files = {"train": "train.csv", "val": "val.csv", "train-val": "train-val.csv", "test": "test.csv", "all": "dataset.csv"}
+    return os.path.join(module_dir, '../DataFiles', files[split])
+
+
+def get_cache_path(path, suffix=''):
+    '''
+    Given the path of a csv file, returns the path of its columnar (parquet) cache which lives next to it. The
+    suffix distinguishes the caches of other tables derived from the same csv (e.g., '-languages').
+    '''
+    return os.path.splitext(path)[0] + suffix + '.parquet'
+
+
+def file_fingerprint(path):
+    '''
+    A cheap fingerprint of a file based on its size and modification time. A cache is only valid if it was
+    built from a source file with the same fingerprint (and by the same cache version).
+    '''
+    stat = os.stat(path)
+    return f'{CACHE_VERSION}-{stat.st_size}-{stat.st_mtime_ns}'
+
+
+def cast_types(ds):
+    '''
+    Casts every column to the compact dtype declared for it in the schema. Missing labels become the "-1" category
+    while missing counts stay missing (nullable integers).
+    '''
+    return apply_schema(ds)
+
+
+def write_cache(ds, path, suffix=''):
+    '''
+    Writes the typed dataframe read (or derived) from the csv file at path into its parquet cache and stamps the
+    cache with the fingerprint of the csv file.
+    '''
+    table = pa.Table.from_pandas(ds, preserve_index=False)
+    metadata = {**(table.schema.metadata or {}), b'source_fingerprint': file_fingerprint(path).encode()}
+    # written next to the cache and moved over it so that concurrent readers never see a half-written file
+    cache_path = get_cache_path(path, suffix)
+    temp_path = f'{cache_path}.{os.getpid()}.tmp'
+    try:
+        # moderate row groups let the row filters of read_data skip whole groups using their statistics
+        pq.write_table(table.replace_schema_metadata(metadata), temp_path, row_group_size=100_000)
+        os.replace(temp_path, cache_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def is_cache_valid(path, suffix=''):
+    '''
+    Checks whether the parquet cache of the csv file at path exists and was built from its current version.
+    '''
+    cache_path = get_cache_path(path, suffix)
+    if not os.path.exists(cache_path):
+        return False
+    metadata = pq.read_schema(cache_path).metadata or {}
+    return metadata.get(b'source_fingerprint') == file_fingerprint(path).encode()
+
+
+def ingest(ds, path):
+    '''
+    Given the raw dataframe read from the csv file at path, it builds all of its caches: the typed dataset and
+    its repo-language table and its aggregate cube.
+    '''
+    ds = cast_types(ds)
+    write_cache(ds, path)
+    write_cache(build_language_table(ds), path, '-languages')
+    write_cache(build_cube(ds), path, '-cube')
+
+
+def ensure_cache(path):
+    '''
+    Builds the caches of the csv file at path (see ingest) unless they're all up to date.
+    '''
+    if not all(is_cache_valid(path, suffix) for suffix in ['', '-languages', '-cube']):
+        ingest(pd.read_csv(path), path)
+
+
+def read_cached(path, columns=None, filters=None):
+    '''
+    Reads the typed version of the csv file at path. The first call parses the csv and builds a parquet cache for
+    it, later calls are served from the cache (only the given columns are read if columns is specified and only
+    the rows satisfying filters if filters is specified).
+    '''
+    if not is_cache_valid(path):
+        ingest(pd.read_csv(path), path)
+    return pd.read_parquet(get_cache_path(path), columns=columns, filters=filters)
+
+
+def read_cached_chunks(path, chunksize, columns=None, filters=None):
+    '''
+    Like read_cached but yields the typed dataset in chunks of at most chunksize rows so that it never has to fit
+    in memory. If the cache is up to date the chunks are streamed from it, otherwise the csv file is streamed and each
+    chunk is typed on its own (the cache is not built as that would need the whole dataset).
+    '''
+    expression = pq.filters_to_expression(filters) if filters else None
+    if is_cache_valid(path):
+        dataset = pa.dataset.dataset(get_cache_path(path))
+        for batch in dataset.to_batches(columns=columns, filter=expression, batch_size=chunksize):
+            if batch.num_rows:
+                yield pa.Table.from_batches([batch]).to_pandas()
+    else:
+        # the columns of the filters are read too (and dropped once the rows are filtered)
+        usecols = columns
+        if columns is not None and filters:
+            usecols = list(columns) + [col for col, _, _ in filters if col not in columns]
+        for chunk in pd.read_csv(path, usecols=usecols, chunksize=chunksize):
+            table = pa.Table.from_pandas(cast_types(chunk), preserve_index=False)
+            if expression is not None:
+                table = table.filter(expression)
+            if columns is not None:
+                table = table.select(list(columns))
+            if table.num_rows:
+                yield table.to_pandas()
+
 
-    # randomly shuffle the data
-    ds = ds.sample(frac=1, random_state=42).reset_index(drop=True)
+def read_language_table(split="train", columns=None):
+    '''
+    Reads the repo-language table of the given split (see build_language_table) from its cache. Join it with a
+    dataset by nameWithOwner (its repo_row is only the row of the repository in the split's csv file).
+    '''
+    path = get_split_path(split)
+    if not is_cache_valid(path, '-languages'):
+        # reading (re)ingests the csv if the dataset's cache is outdated too
+        ds = read_cached(path, columns=['nameWithOwner', 'languages', 'primaryLanguage'])
+        if not is_cache_valid(path, '-languages'):
+            write_cache(build_language_table(ds), path, '-languages')
+    return pd.read_parquet(get_cache_path(path, '-languages'), columns=columns)
 
-    # random split the test into 70% train, 20% val, 10% test
-    train, val, test = np.split(ds.sample(frac=1, random_state=42), [int(.7*len(ds)), int(.9*len(ds))])
 
-    # save the data
-    train.to_csv('../DataFiles/train.csv', index=False)
-    val.to_csv('../DataFiles/val.csv', index=False)
-    test.to_csv('../DataFiles/test.csv', index=False)
+def read_cube(split="train"):
+    '''
+    Reads the aggregate cube of the given split (see build_cube) from its cache; it covers the whole split (before
+    any of the preprocessing or row filters of read_data).
+    '''
+    path = get_split_path(split)
+    if not is_cache_valid(path, '-cube'):
+        ds = read_cached(path, columns=['createdAt', 'primaryLanguage', 'license', 'isArchived'] + CUBE_MEASURES)
+        if not is_cache_valid(path, '-cube'):
+            write_cache(build_cube(ds), path, '-cube')
+    return pd.read_parquet(get_cache_path(path, '-cube'))
+
+
+def get_filters(languages=None, years=None, archived=None):
+    '''
+    Translates the simple row filters of read_data into parquet filters so that they are applied while reading.
+    languages is a collection of primary languages to keep, years is an inclusive (first, last) range for the
+    year of createdAt and archived keeps only archived (True) or only non-archived (False) repositories.
+    '''
+    filters = []
+    if languages is not None:
+        filters.append(('primaryLanguage', 'in', list(languages)))
+    if years is not None:
+        first, last = years
+        filters.append(('createdAt', '>=', pd.Timestamp(year=first, month=1, day=1, tz='UTC')))
+        filters.append(('createdAt', '<', pd.Timestamp(year=last + 1, month=1, day=1, tz='UTC')))
+    if archived is not None:
+        filters.append(('isArchived', '==', bool(archived)))
+    return filters if filters else None
 
 
-def read_data(kind=None, y_data_col=None, execlude=[], split="train", fix=False, handle_langs=False, handle_useless=""):
+def ensure_split():
+    '''
+    If there exists not a train, val or test file, it splits the dataset.
+    '''
+    module_dir = os.path.dirname(__file__)
+    if not os.path.exists(os.path.join(module_dir, '../DataFiles/train.csv')) and not os.path.exists(os.path.join(module_dir, '../DataFiles/val.csv')) and not os.path.exists(os.path.join(module_dir, '../DataFiles/test.csv')):
+        split_script()
+
+
+def read_data(kind=None, y_data_col=None, execlude=[], split="train", fix=False, handle_langs=False, handle_useless="",
+              columns=None, languages=None, years=None, archived=None, n_jobs=1):
     '''
     reads the dataset from the folder and return it; if data is not split (only dataset.csv exists), it splits it first.
     If kind is specified, it returns only the categorical or numerical features.
     y_data_col allows extracting a specific column into y_data. If not specified, y_data is None.
     execlude allows excluding specific columns from the dataset.
     fix fixes any issies in the dataset, for a per-issue decisions, consider the rest of the parameters.
+    columns allows reading only specific columns; the rest are never loaded.
+    languages, years and archived filter the rows while reading (see get_filters); filtered rows are never loaded.
+    n_jobs is the number of processes used to parse the languages column (see parse_languages).
+    Results that fit in READ_CACHE_BUDGET are memoized (see read_memoized) so repeated calls skip reading and parsing;
+    each call gets its own copy so it may be modified freely.
     '''
-    module_dir = os.path.dirname(__file__)
-    # if there exists not a train, val or test file, split the dataset
-    if not os.path.exists(os.path.join(module_dir, '../DataFiles/train.csv')) and not os.path.exists(os.path.join(module_dir, '../DataFiles/val.csv')) and not os.path.exists(os.path.join(module_dir, '../DataFiles/test.csv')):
-        split_script()
-    
-    if split == "train":    path = os.path.join(module_dir, '../DataFiles/train.csv')
-    elif split == "val":    path = os.path.join(module_dir, '../DataFiles/val.csv')
-    elif split == "train-val":    path = os.path.join(module_dir, '../DataFiles/train-val.csv')
-    elif split == "test":   path = os.path.join(module_dir, '../DataFiles/test.csv')
-    elif split == "all":   path = os.path.join(module_dir, '../DataFiles/dataset.csv')
-    
-    # read
-    ds = pd.read_csv(path)
-    
-    # let missing values be -1 or "-1" as a temporary handling depending on column type
-    for col in ds.columns:
-        if type(ds.iloc[0, ds.columns.get_loc(col)]) == str:
-            ds[col] = ds[col].fillna("-1")
-        else:
-            ds[col] = ds[col].fillna(-1)
-        
-    # cast codeOfConduct to string
-    ds['codeOfConduct'] = ds['codeOfConduct'].astype(str)
-    # cast createdAt to datetime
-    ds['createdAt'] = pd.to_datetime(ds['createdAt'])
-    # cast isArchived, defaultBranchCommitCount
-    ds['isArchived'] = ds['isArchived'].astype(int)
-    # cast isForked to int
-    ds['isFork'] = ds['isFork'].astype(int)
-    # cast forkingAllowed to int
-    ds['forkingAllowed'] = ds['forkingAllowed'].astype(int)
-    
+    ensure_split()
+    path = get_split_path(split)
+    key = (path, file_fingerprint(path), kind, get_key(y_data_col), get_key(execlude), fix, handle_langs, handle_useless,
+           get_key(columns), get_key(languages), get_key(years), archived)
+    return read_memoized(key, lambda: read_prepared(path, kind, y_data_col, execlude, fix, handle_langs, handle_useless,
+                                                    columns, languages, years, archived, n_jobs))
+
+
+def read_prepared(path, kind, y_data_col, execlude, fix, handle_langs, handle_useless, columns, languages, years, archived, n_jobs):
+    '''
+    The uncached read_data of the csv file at path.
+    '''
+    # read (from the columnar cache whenever it's up to date with the csv file)
+    ds = read_cached(path, columns=columns, filters=get_filters(languages, years, archived))
+    return prepare_data(ds, kind, y_data_col, execlude, fix, handle_langs, handle_useless, n_jobs)
+
+
+def get_key(value):
+    '''
+    Makes an argument of read_data hashable (collections become tuples).
+    '''
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(value))
+    if isinstance(value, (list, tuple, pd.Index, pd.Series, np.ndarray)):
+        return tuple(value)
+    return value
+
+
+def get_memory_usage(x_data, y_data):
+    '''
+    The number of bytes taken by the arrays of a result of read_data (not counting the strings that object columns
+    point to, which would take a walk over all of them).
+    '''
+    # y_data may be a series or a frame
+    usage = np.sum(x_data.memory_usage(deep=False))
+    return usage + (np.sum(y_data.memory_usage(deep=False)) if y_data is not None else 0)
+
+
+def read_memoized(key, read):
+    '''
+    Returns the memoized result of read_data for key (the arguments and the fingerprint of the split's csv file) or
+    calls read to get it and memoizes it; the least recently used results are evicted to stay within READ_CACHE_BUDGET
+    and results larger than it aren't memoized at all. The caller gets deep copies of memoized results so no change it
+    makes (in place or not) reaches them (the pinned pandas has no copy-on-write mode to make this cheaper).
+    '''
+    if key in READ_CACHE:
+        READ_CACHE.move_to_end(key)
+    else:
+        x_data, y_data = read()
+        usage = get_memory_usage(x_data, y_data)
+        if usage > READ_CACHE_BUDGET:
+            # nothing else holds the result so the caller gets it as is
+            return x_data, y_data
+        READ_CACHE[key] = (x_data, y_data, usage)
+        while sum(usage for _, _, usage in READ_CACHE.values()) > READ_CACHE_BUDGET:
+            READ_CACHE.popitem(last=False)
+    x_data, y_data, _ = READ_CACHE[key]
+    return x_data.copy(deep=True), (y_data.copy(deep=True) if y_data is not None else None)
+
+
+def clear_read_cache():
+    '''
+    Frees the memory taken by the memoized results of read_data.
+    '''
+    READ_CACHE.clear()
+
+
+def iter_data(chunksize=100_000, kind=None, y_data_col=None, execlude=[], split="train", fix=False, handle_langs=False,
+              handle_useless="", columns=None, languages=None, years=None, archived=None, n_jobs=1):
+    '''
+    The out-of-core version of read_data: it yields (x_data, y_data) for each chunk of at most chunksize rows of the
+    split, each preprocessed exactly as read_data would (see its parameters). Combine the results over the chunks
+    with the streaming reducers (stream_value_counts, stream_group_counts).
+    '''
+    ensure_split()
+    chunks = read_cached_chunks(get_split_path(split), chunksize, columns=columns, filters=get_filters(languages, years, archived))
+    for ds in chunks:
+        yield prepare_data(ds, kind, y_data_col, execlude, fix, handle_langs, handle_useless, n_jobs)
+
+
+def prepare_data(ds, kind=None, y_data_col=None, execlude=[], fix=False, handle_langs=False, handle_useless="", n_jobs=1):
+    '''
+    Applies the preprocessing of read_data (see its parameters) to the typed dataset (or chunk of it) ds and returns
+    x_data, y_data.
+    '''
+    # columns that were not read need not be dropped
     if handle_useless == "all-except-description":
-        ds = ds.drop(['isFork', 'forkingAllowed', 'parent', 'owner', 'name', 'nameWithOwner', 'pushedAt'], axis=1) 
+        ds = ds.drop(['isFork', 'forkingAllowed', 'parent', 'owner', 'name', 'nameWithOwner', 'pushedAt'], axis=1, errors='ignore') 
     elif handle_useless == "obvious":
         # drop useless columns
-        ds = ds.drop(['owner', 'name', 'nameWithOwner', 'description', 'pushedAt'], axis=1)         # won't be used
+        ds = ds.drop(['owner', 'name', 'nameWithOwner', 'description', 'pushedAt'], axis=1, errors='ignore')         # won't be used
     elif handle_useless == "all" or fix:    
         # drop constant or nan columns
-        ds = ds.drop(['isFork', 'forkingAllowed', 'parent', 'owner', 'name', 'nameWithOwner', 'description', 'pushedAt'], axis=1)         # won't be used
+        ds = ds.drop(['isFork', 'forkingAllowed', 'parent', 'owner', 'name', 'nameWithOwner', 'description', 'pushedAt'], axis=1, errors='ignore')         # won't be used
     
-    if handle_langs or fix:
+    if (handle_langs or fix) and 'languages' in ds.columns:
         # handle the languages column
-        ds = handle_languages_column(ds)
+        ds = handle_languages_column(ds, n_jobs)
     
     if y_data_col:
         # all columns except Body_Level go to x_data
@@ -100,15 +379,13 @@ def read_data(kind=None, y_data_col=None, execlude=[], split="train", fix=False,
     
     if kind == "Categorical":
         # extract only the categorical features
-        disc_feats = [feat for feat in x_data.columns if type(x_data.iloc[0, x_data.columns.get_loc(feat)]) == str]
+        disc_feats = [feat for feat in x_data.columns if is_categorical(x_data, feat)]
         x_data = x_data[disc_feats]
         
     elif kind == "Numerical":
-        # extract only the numerical features
-        cont_feats = [feat for feat in x_data.columns if type(x_data.iloc[0, x_data.columns.get_loc(feat)]) != str]
-        x_data = x_data[cont_feats]
-        for feat in x_data.columns:
-            x_data[feat] = x_data[feat].astype(float)
+        # extract only the numerical features (missing values become NaN)
+        cont_feats = [feat for feat in x_data.columns if is_numerical(x_data, feat)]
+        x_data = x_data[cont_feats].astype(float)
     
     if execlude:
         x_data = x_data.drop(execlude, axis=1)
@@ -117,40 +394,332 @@ def read_data(kind=None, y_data_col=None, execlude=[], split="train", fix=False,
 
 
 
-def handle_languages_column(x_data):
+def get_group_keys(x_data, by):
+    '''
+    Given a chunk and a column (or list of columns) to group by, returns the keys to pass to groupby. Categorical
+    columns are grouped by their labels as the categories differ from chunk to chunk.
+    '''
+    by = [by] if isinstance(by, str) else list(by)
+    return [x_data[col].astype(object) if isinstance(x_data[col].dtype, pd.CategoricalDtype) else x_data[col] for col in by]
+
+
+def stream_group_counts(chunks, by):
+    '''
+    Given an iterable of chunks (such as the x_data of iter_data), returns the number of rows in each group of the
+    given column (or list of columns) over all the chunks.
+    '''
+    counts = None
+    for x_data in chunks:
+        part = x_data.groupby(get_group_keys(x_data, by)).size()
+        counts = part if counts is None else counts.add(part, fill_value=0)
+    return counts.astype('int64')
+
+
+def stream_value_counts(chunks, col):
+    '''
+    Given an iterable of chunks, returns the value counts of the given column over all the chunks (sorted descendingly
+    like pd.Series.value_counts).
+    '''
+    return stream_group_counts(chunks, col).sort_values(ascending=False).rename('count')
+
+
+def get_comoments(values):
+    '''
+    Given a 2-D array of features (NaN for missing values), returns the pairwise statistics that the Pearson
+    correlation needs (each over the rows where both features of the pair are present) as a dictionary of
+    features x features arrays: n (count), mean ([i, j] is the mean of i), m2 ([i, j] is the sum of squared deviations
+    of i from its mean) and c (the co-moment; the sum of the products of the deviations).
+    '''
+    present = ~np.isnan(values)
+    # shifting by the means keeps the sums small (the statistics don't depend on the shift)
+    shift = np.nanmean(values, axis=0) if present.any() else np.zeros(values.shape[1])
+    shift = np.nan_to_num(shift)
+    centered = np.where(present, values - shift, 0.0)
+    mask = present.astype(float)
+    n = mask.T @ mask
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # [i, j] is the mean of i over the rows where i and j are present
+        mean = np.nan_to_num((centered.T @ mask) / n)
+    m2 = (centered**2).T @ mask - n * mean**2
+    c = centered.T @ centered - n * mean * mean.T
+    return {'n': n, 'mean': mean + shift[:, None], 'm2': m2, 'c': c}
+
+
+def merge_comoments(stats, other):
+    '''
+    Merges the statistics of get_comoments of two chunks into those of both (Chan's pairwise update).
+    '''
+    n = stats['n'] + other['n']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weight = np.nan_to_num(stats['n'] * other['n'] / n)
+        other_share = np.nan_to_num(other['n'] / n)
+    delta = other['mean'] - stats['mean']
+    return {
+        'n': n,
+        'mean': stats['mean'] + delta * other_share,
+        'm2': stats['m2'] + other['m2'] + delta**2 * weight,
+        'c': stats['c'] + other['c'] + delta * delta.T * weight,
+    }
+
+
+def get_correlation(stats, columns):
+    '''
+    Given the (merged) statistics of get_comoments, returns the correlation matrix of the columns as a dataframe.
+    '''
+    with np.errstate(invalid='ignore', divide='ignore'):
+        corr = stats['c'] / np.sqrt(stats['m2'] * stats['m2'].T)
+    corr = np.clip(corr, -1, 1)
+    corr[stats['n'] < 2] = np.nan
+    return pd.DataFrame(corr, index=columns, columns=columns)
+
+
+def get_correlation_values(x_data, columns, method='pearson'):
+    '''
+    The values of the columns of a chunk that stream_correlation correlates: floats for pearson and, for spearman,
+    the ranks within the chunk scaled to [0, 1].
+    '''
+    values = x_data[columns].astype(float)
+    if method == 'spearman':
+        values = values.rank(pct=True)
+    return values.to_numpy(dtype=float, na_value=np.nan)
+
+
+def stream_correlation(chunks, columns=None, method='pearson', by=None):
+    '''
+    Given a dataframe or an iterable of chunks, returns the correlation matrix of the given columns (the numerical ones
+    by default) over all the rows (pairwise complete like pd.DataFrame.corr). Each chunk is reduced to co-moments
+    that are merged, so the pearson correlation is exact however many chunks there are. The spearman correlation
+    ranks each column within each chunk (over all of its present values rather than over the rows where both columns
+    of a pair are present), so it's exact only for one chunk without missing values; with missing values or several
+    chunks it's approximate (as good as the chunks are random samples).
+    If by is given (a column or list of columns), the correlation matrices of each group are computed in the same
+    pass and returned stacked like pd.DataFrame.groupby(by).corr() does.
+    '''
+    chunks = [chunks] if isinstance(chunks, pd.DataFrame) else chunks
+    stats = {}
+    for x_data in chunks:
+        if columns is None:
+            columns = [feat for feat in x_data.columns if is_numerical(x_data, feat) and feat not in ([by] if isinstance(by, str) else (by or []))]
+        if by is None:
+            parts = [(None, x_data)]
+        else:
+            parts = x_data.groupby(get_group_keys(x_data, by), observed=True, sort=False)
+        for key, part in parts:
+            part_stats = get_comoments(get_correlation_values(part, columns, method))
+            stats[key] = merge_comoments(stats[key], part_stats) if key in stats else part_stats
+
+    if by is None:
+        return get_correlation(stats[None], columns)
+    keys = sorted(stats, key=str)
+    return pd.concat([get_correlation(stats[key], columns) for key in keys], keys=keys)
+
+
+
+# matches the name and size of one language in a raw languages entry such as "[{'name': 'C', 'size': 2081}]"
+# (names containing a single quote are written between double quotes)
+LANGUAGE_PATTERN = re.compile(r"""['"]name['"]:\s*(?:'([^']*)'|"([^"]*)"),\s*['"]size['"]:\s*(\d+)""")
+
+
+def parse_languages_chunk(lang_data):
+    '''
+    Given a list of raw languages entries, it reads each entry once and returns the names and sizes of all the
+    languages in them (flattened) and the number of languages in each entry.
+    '''
+    names, sizes, counts = [], [], []
+    for entry in lang_data:
+        pairs = [(single or double, size) for single, double, size in LANGUAGE_PATTERN.findall(entry)]
+        # an entry in an unexpected format falls back to the exact (but slow) parser
+        if len(pairs) != entry.count('{'):
+            pairs = [(lang['name'], lang['size']) for lang in ast.literal_eval(entry)]
+        names.extend(name for name, _ in pairs)
+        sizes.extend(int(size) for _, size in pairs)
+        counts.append(len(pairs))
+    return names, sizes, counts
+
+
+def parse_languages(languages, n_jobs=1):
+    '''
+    Parses the raw languages column in a single pass into a compact form (CSR):
+    - names: each distinct language name once (sorted); the code of a language is its index in names
+    - codes, sizes: the language code and size (bytes) of each (repository, language) pair
+    - offsets: the pairs of the i-th repository are codes[offsets[i]:offsets[i+1]] and sizes[offsets[i]:offsets[i+1]]
+    If n_jobs > 1 then chunks of the column are parsed in parallel by n_jobs processes.
+    '''
+    lang_data = list(languages)
+    if n_jobs > 1:
+        # a few chunks per process to balance the load
+        bounds = np.linspace(0, len(lang_data), 4 * n_jobs + 1).astype(int)
+        chunks = [lang_data[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+        with Pool(n_jobs) as pool:
+            results = pool.map(parse_languages_chunk, chunks)
+    else:
+        results = [parse_languages_chunk(lang_data)]
+
+    # intern the names into codes and put the flat pairs into typed arrays
+    all_names = [name for names, _, _ in results for name in names]
+    codes, names = pd.factorize(pd.Series(all_names, dtype=object), sort=True)
+    sizes = np.fromiter((size for _, sizes, _ in results for size in sizes), dtype=np.int64, count=len(all_names))
+    counts = np.fromiter((count for _, _, counts in results for count in counts), dtype=np.int64, count=len(lang_data))
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    return np.asarray(names, dtype=object), codes.astype(np.int32), sizes, offsets
+
+
+def handle_languages_column(x_data, n_jobs=1):
     '''
     Breaks down the unstructured languages column into two columns: languages_used and language_sizes.
     The first is a list of the languages used in the repository and the second is the size of each language.
+    Both are comma separated strings made from a single pass of parse_languages (n_jobs is passed to it).
     '''
-    def get_language_names(lang_data):
-        '''
-        Given a language data entry, it returns the names of the languages used in the repository.
-        '''
-        lang_data = ast.literal_eval(lang_data)
-        # get the 'name' key's value from element in lang_0 
-        names = [lang_data[i]['name'] for i in range(len(lang_data))]
-        # convert to string
-        names = ', '.join(names)
-        return names
-
-    def get_language_sizes(lang_data):
-        '''
-        Given a language data entry, it returns the sizes of the languages used in the repository.
-        '''
-        lang_data = ast.literal_eval(lang_data)
-        # get the 'name' key's value from element in lang_0 
-        sizes = [lang_data[i]['size'] for i in range(len(lang_data))]
-        sizes = ', '.join([str(size) for size in sizes])
-        return sizes
-
+    names, codes, sizes, offsets = parse_languages(x_data['languages'], n_jobs)
     # make a new column languages_used and language_sizes
-    x_data['languagesUsed'] = x_data['languages'].apply(get_language_names)
-    x_data['languagesSizes'] = x_data['languages'].apply(get_language_sizes)
+    used, sizes = names[codes].tolist(), sizes.astype(str).tolist()
+    bounds = list(zip(offsets[:-1], offsets[1:]))
+    x_data['languagesUsed'] = [', '.join(used[start:end]) for start, end in bounds]
+    x_data['languagesSizes'] = [', '.join(sizes[start:end]) for start, end in bounds]
     # drop the languages column
     x_data = x_data.drop('languages', axis=1)
     return x_data
 
 
+def build_language_table(x_data, n_jobs=1):
+    '''
+    Explodes the raw languages column into a long table with one row per (repository, language) pair:
+    - repo_row: the index of the repository in x_data
+    - nameWithOwner: the name of the repository (the key to join the table with a dataset however it was filtered)
+    - language: the language (categorical, so its codes are the interned language codes)
+    - bytes: the size of the language in the repository
+    - share: the fraction of the repository's bytes written in the language
+    - is_primary: whether it's the primary language of the repository
+    The rows of each repository are contiguous and in the order of its languages entry.
+    '''
+    names, codes, sizes, offsets = parse_languages(x_data['languages'], n_jobs)
+    counts = np.diff(offsets)
+    repos = np.repeat(np.arange(len(x_data)), counts)
+    # total bytes of each repository to get the share of each of its languages
+    totals = np.bincount(repos, weights=sizes, minlength=len(x_data))
+    shares = np.divide(sizes, totals[repos], out=np.zeros(len(sizes)), where=totals[repos] > 0)
+    # primary language of each repository as a code among names (-1 if it's not one of them)
+    primary_codes = pd.Categorical(x_data['primaryLanguage'].astype(str), categories=names).codes
+    return pd.DataFrame({
+        'repo_row': x_data.index.to_numpy()[repos],
+        'nameWithOwner': x_data['nameWithOwner'].to_numpy()[repos],
+        'language': pd.Categorical.from_codes(codes, categories=names),
+        'bytes': sizes,
+        'share': shares.astype(np.float32),
+        'is_primary': codes == primary_codes[repos],
+    })
+
+
+def get_language_totals(lang_table):
+    '''
+    Given a repo-language table, it returns per language: the total bytes written in it, the number of repositories
+    using it, the number of repositories where it's the primary language and the share of the latter (sorted by usage).
+    '''
+    totals = lang_table.groupby('language', observed=True).agg(bytes=('bytes', 'sum'), repos=('repo_row', 'size'),
+                                                                primary_repos=('is_primary', 'sum'))
+    totals['primary_share'] = totals['primary_repos'] / totals['repos']
+    return totals.sort_values('repos', ascending=False)
+
+
+def get_co_usage(lang_table):
+    '''
+    Given a repo-language table, it returns a languages x languages dataframe where the entry of (a, b) is the number
+    of repositories using both a and b (the diagonal is the number of repositories using each language).
+    '''
+    repos = pd.factorize(lang_table['repo_row'])[0]
+    languages = lang_table['language'].cat.categories
+    # one-hot repos x languages matrix; its gram matrix counts the co-usages
+    usage = sparse.csr_matrix((np.ones(len(repos), dtype=np.int64), (repos, lang_table['language'].cat.codes)),
+                              shape=(repos.max() + 1 if len(repos) else 0, len(languages)))
+    return pd.DataFrame((usage.T @ usage).toarray(), index=languages, columns=languages)
+
+
+def get_language_lists(lang_table, repos):
+    '''
+    Given a repo-language table and the nameWithOwner column of a dataset, returns a series (with the same index)
+    with the list of languages of each repository of the dataset (an empty list if it has none).
+    '''
+    repo_rows = lang_table['repo_row'].to_numpy()
+    names = lang_table['language'].astype(str).tolist()
+    # the rows of each repository are contiguous so each is the slice from its first row to the next one's
+    starts = np.flatnonzero(np.r_[True, repo_rows[1:] != repo_rows[:-1]]) if len(repo_rows) else np.zeros(0, dtype=int)
+    ends = np.r_[starts[1:], len(repo_rows)].astype(int)
+    positions = pd.Index(lang_table['nameWithOwner'].to_numpy()[starts]).get_indexer(repos)
+    return pd.Series([names[starts[pos]:ends[pos]] if pos >= 0 else [] for pos in positions], index=repos.index, dtype=object)
+
+
+def build_cube(ds):
+    '''
+    Aggregates the dataset in one pass into a cube with one row per observed combination of the dimensions in
+    CUBE_DIMENSIONS (year and month of createdAt unless the dataset has year and month columns already) holding the
+    number of repositories (count), the number of archived ones (archived) and the sums of CUBE_MEASURES. Dimensions
+    and measures missing from the dataset are left out. Count questions are then answered by rollup.
+    '''
+    frame = {}
+    if 'year' not in ds.columns or 'month' not in ds.columns:
+        dates = pd.to_datetime(ds['createdAt'], utc=True)
+    frame['year'] = ds['year'] if 'year' in ds.columns else dates.dt.year
+    frame['month'] = ds['month'] if 'month' in ds.columns else dates.dt.month
+    frame.update({dim: ds[dim] for dim in CUBE_DIMENSIONS[2:] if dim in ds.columns})
+    dimensions = list(frame)
+    frame['archived'] = ds['isArchived'].astype(bool) if 'isArchived' in ds.columns else False
+    measures = ['archived'] + [measure for measure in CUBE_MEASURES if measure in ds.columns]
+    frame.update({measure: ds[measure] for measure in measures[1:]})
+
+    cube = pd.DataFrame(frame).groupby(dimensions, observed=True, dropna=False, sort=True)
+    cube = cube.agg(count=('year', 'size'), **{measure: (measure, 'sum') for measure in measures}).reset_index()
+    return cube.astype({'count': 'int64', **{measure: 'int64' for measure in measures}})
+
+
+def rollup(cube, by=None, **where):
+    '''
+    Rolls a cube of build_cube up to the given dimension (or list of dimensions) keeping only the cells where each
+    dimension given as a keyword has the given value (or one of the given values); e.g., rollup(cube, 'primaryLanguage',
+    year=2020) or rollup(cube, ['year', 'month'], primaryLanguage=['Python', 'Ruby']). Returns the summed measures per
+    group (sorted by group) or over all the cells if by is None.
+    '''
+    measures = [column for column in cube.columns if column not in CUBE_DIMENSIONS]
+    mask = np.ones(len(cube), dtype=bool)
+    for dim, value in where.items():
+        values = [value] if isinstance(value, str) or np.isscalar(value) else list(value)
+        mask &= cube[dim].isin(values).to_numpy()
+    cells = cube[mask]
+    if by is None:
+        return cells[measures].sum()
+    return cells.groupby(by, observed=True)[measures].sum()
+
+
+def check_cube(cube, ds):
+    '''
+    Raises a ValueError unless cube (e.g., from read_cube) is consistent with the dataset ds: it must count as many
+    repositories as ds has (and as many archived ones if ds has isArchived). A cube of a split only answers for the
+    whole split, so questions that filter its rows must build the cube of what they kept instead.
+    '''
+    if cube['count'].sum() != len(ds):
+        raise ValueError(f"The cube counts {cube['count'].sum()} repositories but the dataset has {len(ds)}; "
+                         "is it the cube of another split or was the dataset filtered?")
+    if 'isArchived' in ds.columns and cube['archived'].sum() != ds['isArchived'].astype(bool).sum():
+        raise ValueError(f"The cube counts {cube['archived'].sum()} archived repositories but the dataset has {ds['isArchived'].astype(bool).sum()}")
+
+
+def resample_metric(ds, metric, time_col='pushedAt', freq='MS', languages=None, drop_empty=True):
+    '''
+    Sums the given metric (e.g., pullRequests) over each period of the given frequency ('MS' for months, 'W' for weeks,
+    'D' for days, ...) of time_col in one pass and returns a frame with a column for the metric indexed by the period
+    (Date, a DatetimeIndex labelled as by pd.Series.resample; the first day of each month for 'MS') ready for
+    per-period features. Only the repositories with a primary language in languages are counted if specified and
+    periods summing to zero are dropped if drop_empty. Missing values of the metric count as zero.
+    '''
+    if languages is not None:
+        ds = ds[ds['primaryLanguage'].isin(list(languages))]
+    dates = pd.to_datetime(ds[time_col], utc=True).dt.tz_convert(None)
+    dtype = 'int64' if pd.api.types.is_integer_dtype(ds[metric].dtype) else float
+    values = pd.Series(ds[metric].to_numpy(dtype=dtype, na_value=0), index=dates.to_numpy())
+    series = values.resample(freq).sum()
+    if drop_empty:
+        series = series[series != 0]
+    return series.rename(metric).rename_axis('Date').to_frame()
+
 
 def get_date_features(x_data_d, date_col, merge=False):
     '''
@@ -174,46 +743,85 @@ def get_date_features(x_data_d, date_col, merge=False):
     return cols
 
 
-def impute_outliers(x_data,imputation_method="median", n_imputations=1):
+def get_digest(data):
+    '''
+    A digest of the values of a column or a dataframe (not of its index) to key what's cached for them.
+    '''
+    digest = hashlib.blake2b()
+    for _, col in ([(data.name, data)] if isinstance(data, pd.Series) else data.items()):
+        digest.update(pd.util.hash_pandas_object(col, index=False).to_numpy().data)
+    return digest.hexdigest()
+
+
+def get_quartiles(x_data, columns=None):
+    '''
+    Returns a dataframe with the q1, median, q3 and iqr of each of the given columns (the count and number columns by
+    default) ignoring missing values. They are computed in a single pass over the columns as one 2-D array; the
+    outlier fences of a column are q1 - k * iqr and q3 + k * iqr. They are cached for the values of the columns (the
+    QUARTILES_CACHE_SIZE most recently used) so repeated calls on the same data only hash it.
+    '''
+    if columns is None:
+        columns = [feat for feat in x_data.columns if get_kind(x_data, feat) in ['count', 'number']]
+    key = (tuple(columns), tuple(str(x_data[col].dtype) for col in columns), get_digest(x_data[list(columns)]))
+    if key in QUARTILES_CACHE:
+        QUARTILES_CACHE.move_to_end(key)
+    else:
+        QUARTILES_CACHE[key] = compute_quartiles(x_data, columns)
+        if len(QUARTILES_CACHE) > QUARTILES_CACHE_SIZE:
+            QUARTILES_CACHE.popitem(last=False)
+    return QUARTILES_CACHE[key].copy()
+
+
+def compute_quartiles(x_data, columns):
+    '''
+    Computes the quartiles of the given columns that get_quartiles returns.
+    '''
+    values = np.empty((len(x_data), len(columns)))
+    for i, col in enumerate(columns):
+        values[:, i] = x_data[col].to_numpy(dtype=float, na_value=np.nan)
+    quartiles = np.full((3, len(columns)), np.nan)
+    if len(values):
+        quartiles = np.nanquantile(values, [0.25, 0.5, 0.75], axis=0)
+    quartiles = pd.DataFrame(quartiles.T, index=columns, columns=['q1', 'median', 'q3'])
+    quartiles['iqr'] = quartiles['q3'] - quartiles['q1']
+    return quartiles
+
+
+def impute_outliers(x_data,imputation_method="median", n_imputations=1, n_jobs=None, stacked=False):
     '''
     Discards outliers from the dataset.
+    With the multiple imputation method, the n_imputations imputations run in parallel by n_jobs processes (all the
+    cores by default) and are returned as datasets (see get_imputed_dataset) or, if stacked, as a single array of
+    shape (n_imputations, rows, numerical features) holding the imputed numerical features.
     '''
-    # for each numerical column if the IQD condition is met
-    x_data_o = x_data.copy()
-    for feat in x_data_o.columns:
-        if type(x_data_o.iloc[0, x_data_o.columns.get_loc(feat)]) in [np.float64, np.int64]:
-            Q1, Q3 = x_data_o[feat].quantile(0.25), x_data_o[feat].quantile(0.75)
-            iqr = Q3 - Q1
-            # replace outliers with the median
-            if imputation_method == "median":
-              x_data_o.loc[x_data_o[feat] > Q3 + 3 * iqr, feat] = x_data_o[feat].median()
-            elif imputation_method == "multiple":
-              x_data_o.loc[x_data_o[feat] > Q3 + 3 * iqr, feat] = np.nan #remove outliers
+    # for each numerical column if the IQD condition is met (columns are replaced, never modified, so a shallow copy does)
+    x_data_o = x_data.copy(deep=False)
+    # quantities that can have outliers (flags can't)
+    num_feats = [feat for feat in x_data_o.columns if get_kind(x_data_o, feat) in ['count', 'number']]
+    quartiles = get_quartiles(x_data_o, num_feats)
+    for feat in num_feats:
+        Q3, iqr = quartiles.loc[feat, 'q3'], quartiles.loc[feat, 'iqr']
+        outliers = (x_data_o[feat] > Q3 + 3 * iqr).fillna(False)
+        # replace outliers with the median (the median may not fit in an integer column)
+        if imputation_method == "median":
+          x_data_o[feat] = x_data_o[feat].astype(float).mask(outliers, quartiles.loc[feat, 'median'])
+        elif imputation_method == "multiple":
+          x_data_o[feat] = x_data_o[feat].astype(float).mask(outliers, np.nan) #remove outliers
 
     if imputation_method == "multiple":
         np.random.seed(42)
         seeds = np.random.randint(0, 10000, n_imputations)
-        imputed_datasets = []
-        for seed in seeds:
-            # initialize the used methods
-            imputer = IterativeImputer(estimator=SGDRegressor(),
-                                    max_iter=10, 
-                                    random_state=seed, 
-                                    n_nearest_features=5)
-            scaler = StandardScaler()
-            # remove categorical columns
-            x_data_o_temp = x_data_o.select_dtypes(include=[np.float64, np.int64])
-            columns = x_data_o_temp.columns
-            # scale the data for numerical stability
-            x_data_o_temp = pd.DataFrame(scaler.fit_transform(x_data_o_temp), columns=columns)
-            # impute the outliers
-            x_data_o_temp = pd.DataFrame(imputer.fit_transform(x_data_o_temp), columns=columns)
-            # reverse the scaling
-            x_data_o_temp = pd.DataFrame(scaler.inverse_transform(x_data_o_temp), columns=columns)
-            # get back the categorical columns
-            x_data_o_temp = pd.concat([x_data.select_dtypes(exclude=[np.float64, np.int64]), x_data_o_temp], axis=1)
-            imputed_datasets.append(x_data_o_temp)
+        # scale the data for numerical stability (once for all the imputations)
+        scaler = StandardScaler()
+        scaled = scaler.fit_transform(x_data_o[num_feats].to_numpy(dtype=float))
+        # impute the outliers
+        imputations = impute_scaled(scaled, seeds, n_jobs)
+        # reverse the scaling
+        imputations = imputations * scaler.scale_ + scaler.mean_
+        if stacked:
+            return imputations
 
+        imputed_datasets = [get_imputed_dataset(x_data, num_feats, imputations[i]) for i in range(n_imputations)]
         if (len(imputed_datasets)==1):
             return imputed_datasets[0]
         else:
@@ -221,6 +829,64 @@ def impute_outliers(x_data,imputation_method="median", n_imputations=1):
 
     return x_data_o
 
+
+def impute_scaled_with_seed(shared_name, shape, seed):
+    '''
+    Imputes the missing values of the (scaled) array held in the shared memory block shared_name with the given seed.
+    '''
+    block = shared_memory.SharedMemory(name=shared_name)
+    try:
+        scaled = np.ndarray(shape, dtype=float, buffer=block.buf)
+        imputer = IterativeImputer(estimator=SGDRegressor(random_state=seed),
+                                max_iter=10, 
+                                random_state=seed, 
+                                n_nearest_features=5)
+        return imputer.fit_transform(scaled)
+    finally:
+        block.close()
+
+
+def impute_scaled(scaled, seeds, n_jobs=None):
+    '''
+    Given the scaled numerical features (with missing values) and a seed per imputation, it returns the imputations
+    stacked in an array of shape (len(seeds), rows, features). The imputations run in parallel by n_jobs processes
+    (all the cores by default) which read the features from shared memory rather than each getting a copy.
+    '''
+    n_jobs = min(len(seeds), n_jobs or os.cpu_count())
+    imputations = np.empty((len(seeds),) + scaled.shape)
+    # share the features with the processes
+    block = shared_memory.SharedMemory(create=True, size=max(scaled.nbytes, 1))
+    try:
+        np.ndarray(scaled.shape, dtype=float, buffer=block.buf)[:] = scaled
+        args = [(block.name, scaled.shape, seed) for seed in seeds]
+        if n_jobs > 1:
+            with Pool(n_jobs) as pool:
+                results = pool.starmap(impute_scaled_with_seed, args)
+        else:
+            results = [impute_scaled_with_seed(*arg) for arg in args]
+        for i, result in enumerate(results):
+            imputations[i] = result
+    finally:
+        block.close()
+        block.unlink()
+    return imputations
+
+
+def get_imputed_dataset(x_data, num_feats, imputation):
+    '''
+    Given the dataset given to impute_outliers, its numerical features and one of the imputations of them (one slice
+    of the stacked result), it builds the imputed dataset.
+    '''
+    x_data_o_temp = pd.DataFrame(imputation, columns=num_feats, index=x_data.index)
+    # get back the categorical columns
+    return pd.concat([x_data.drop(num_feats, axis=1), x_data_o_temp], axis=1)
+
+
 def impute_missing(x_data):
-    x_data = x_data.replace(-1, 0)
+    '''
+    Replaces the missing values of the numerical features with 0.
+    '''
+    num_feats = [feat for feat in x_data.columns if is_numerical(x_data, feat)]
+    x_data = x_data.copy(deep=False)
+    x_data[num_feats] = x_data[num_feats].fillna(0)
     return x_data
\ No newline at end of file
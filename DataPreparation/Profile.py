@@ -0,0 +1,250 @@
+import pandas as pd
+import numpy as np
+from multiprocessing import Pool
+from contextlib import nullcontext
+from DataPreparation.Schema import get_kind, MISSING_LABEL
+from DataPreparation.Preprocess import get_quartiles
+
+
+def get_type(kind, num_uniques, column):
+    '''
+    The type of a column shown by features_info given its kind in the schema and its number of unique values.
+    '''
+    if column in ['languagesUsed', 'languagesSizes']:
+        return 'Composite'
+    if num_uniques == 0:
+        return 'Useless'
+    if num_uniques == 1:
+        return 'Constant'
+    if num_uniques == 2:
+        return 'Binary'
+    if kind == 'date':
+        return 'Date'
+    return 'Categorical' if kind in ['category', 'text', 'composite'] else 'Numerical'
+
+
+def profile_column(col, kind):
+    '''
+    Given a column and its kind, returns its number of unique values and its number of nulls (missing values or
+    the "-1" label for categorical columns) reading it once.
+    '''
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        # counts of each category from the codes (missing values have code -1)
+        codes = col.cat.codes.to_numpy()
+        counts = np.bincount(codes[codes >= 0], minlength=len(col.cat.categories))
+        missing = col.cat.categories.get_indexer([MISSING_LABEL])[0]
+        num_nulls = counts[missing] if missing >= 0 else 0
+        return int((counts > 0).sum()), int(num_nulls)
+    if kind in ['category', 'text', 'composite']:
+        return col.nunique(), int((col.to_numpy() == MISSING_LABEL).sum())
+    return col.nunique(), int(col.isna().sum())
+
+
+def profile_column_star(args):
+    '''
+    profile_column for a (column, kind) pair (used by the processes of profile_features).
+    '''
+    return profile_column(*args)
+
+
+def profile_features(x_data, n_jobs=1):
+    '''
+    Profiles every column of the dataset and returns a dataframe indexed by column with its type, number of unique
+    values, nulls ratio, quartiles and outlier ratio (values above q3 + 3 * iqr; NaN except for count and number columns).
+    Each column is read once (by n_jobs processes in parallel if n_jobs > 1) and the quartiles of all the numerical
+    columns are computed together (see get_quartiles).
+    '''
+    kinds = {column: get_kind(x_data, column) for column in x_data.columns}
+    args = [(x_data[column], kinds[column]) for column in x_data.columns]
+    if n_jobs > 1:
+        with Pool(n_jobs) as pool:
+            stats = pool.map(profile_column_star, args)
+    else:
+        stats = [profile_column(*arg) for arg in args]
+
+    profile = pd.DataFrame(stats, index=x_data.columns, columns=['uniques', 'nulls'])
+    profile.insert(0, 'type', [get_type(kinds[column], profile.loc[column, 'uniques'], column) for column in x_data.columns])
+    profile['nulls_ratio'] = profile['nulls'] / len(x_data) if len(x_data) else 0.0
+
+    # quartiles and outliers of the quantities that can have outliers
+    quartiles = get_quartiles(x_data)
+    profile = profile.join(quartiles)
+    profile['outlier_ratio'] = np.nan
+    for column in quartiles.index:
+        upper = quartiles.loc[column, 'q3'] + 3 * quartiles.loc[column, 'iqr']
+        values = x_data[column].to_numpy(dtype=float, na_value=np.nan)
+        profile.loc[column, 'outlier_ratio'] = (values > upper).sum() / len(x_data)
+    return profile
+
+
+# the number of bits of a hash that pick the register of a HyperLogLog sketch (2**14 registers of one byte each)
+HLL_PRECISION = 14
+
+# the relative accuracy of the quantiles of the quantile sketches
+QUANTILE_ACCURACY = 0.01
+
+# keeps the buckets of the values with magnitude below 1 (negative logarithm) apart from the bucket of zeros
+BUCKET_OFFSET = 2**20
+
+
+def hll_sketch(col, precision=HLL_PRECISION):
+    '''
+    Given a column, returns its HyperLogLog sketch: 2**precision registers holding the maximum rank (position of the
+    first set bit) of the hashes that fall in each. Sketches of chunks merge with np.maximum.
+    '''
+    registers = np.zeros(2**precision, dtype=np.uint8)
+    col = col.dropna()
+    if len(col):
+        hashes = pd.util.hash_pandas_object(col, index=False).to_numpy()
+        buckets = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+        rest = (hashes & np.uint64(2**(64 - precision) - 1)).astype(float)
+        # the bit length of the rest (exact as it has less than 53 bits); the rank of 0 is the largest possible
+        ranks = (64 - precision + 1 - np.frexp(rest)[1]).astype(np.uint8)
+        np.maximum.at(registers, buckets, ranks)
+    return registers
+
+
+def hll_estimate(registers):
+    '''
+    Given a HyperLogLog sketch, returns the estimated number of distinct values (its relative standard error is
+    1.04 / sqrt(number of registers)).
+    '''
+    m = len(registers)
+    estimate = 0.7213 / (1 + 1.079 / m) * m**2 / np.sum(2.0 ** -registers.astype(float))
+    empty = np.count_nonzero(registers == 0)
+    # linear counting is more accurate for small cardinalities
+    if estimate <= 2.5 * m and empty:
+        estimate = m * np.log(m / empty)
+    return int(round(estimate))
+
+
+def quantile_sketch(col, accuracy=QUANTILE_ACCURACY):
+    '''
+    Given a numerical column, returns its quantile sketch: the counts of its values in logarithmic buckets (a
+    DDSketch) so that any quantile is known within the given relative accuracy. It is a series indexed by the signed
+    bucket (0 for zeros, negative for negative values). Sketches of chunks merge with merge_quantile_sketches.
+    '''
+    values = col.to_numpy(dtype=float, na_value=np.nan)
+    values = values[~np.isnan(values)]
+    gamma = (1 + accuracy) / (1 - accuracy)
+    # values with magnitude in (gamma**(k-1), gamma**k] go to bucket +-(k + BUCKET_OFFSET) and zeros to bucket 0
+    buckets = np.zeros(len(values), dtype=np.int64)
+    nonzero = values != 0
+    magnitudes = np.ceil(np.log(np.abs(values[nonzero])) / np.log(gamma)).astype(np.int64)
+    buckets[nonzero] = np.sign(values[nonzero]).astype(np.int64) * (magnitudes + BUCKET_OFFSET)
+    keys, counts = np.unique(buckets, return_counts=True)
+    return pd.Series(counts, index=keys, dtype='int64')
+
+
+def merge_quantile_sketches(sketch, other):
+    '''
+    Merges two quantile sketches (of the same accuracy) into the sketch of all the values of both.
+    '''
+    return sketch.add(other, fill_value=0).astype('int64')
+
+
+def get_bucket_values(keys, accuracy=QUANTILE_ACCURACY):
+    '''
+    Given the buckets of a quantile sketch, returns the value that stands for each of them.
+    '''
+    gamma = (1 + accuracy) / (1 - accuracy)
+    magnitudes = np.abs(keys) - BUCKET_OFFSET
+    return np.where(keys == 0, 0.0, np.sign(keys) * 2 * gamma**magnitudes / (gamma + 1))
+
+
+def sketch_quantiles(sketch, quantiles, accuracy=QUANTILE_ACCURACY):
+    '''
+    Given a quantile sketch, returns the estimates of the given quantiles (each within the relative accuracy of the
+    true value).
+    '''
+    if not sketch.sum():
+        return np.full(len(quantiles), np.nan)
+    sketch = sketch.sort_index()
+    values = get_bucket_values(sketch.index.to_numpy(), accuracy)
+    # the buckets are ordered by value (the larger the magnitude of a negative bucket, the smaller its values)
+    order = np.argsort(values, kind='stable')
+    ranks = np.cumsum(sketch.to_numpy()[order])
+    positions = np.searchsorted(ranks, np.asarray(quantiles) * (ranks[-1] - 1), side='right')
+    return values[order][positions]
+
+
+def sketch_column(col, kind):
+    '''
+    Returns the sketches of one chunk of a column: its HyperLogLog sketch, its number of nulls and its quantile
+    sketch (None unless it's a count or number column).
+    '''
+    if kind in ['category', 'text', 'composite']:
+        nulls = int((col.to_numpy(dtype=object) == MISSING_LABEL).sum())
+    else:
+        nulls = int(col.isna().sum())
+    quantiles = quantile_sketch(col) if kind in ['count', 'number'] else None
+    return hll_sketch(col), nulls, quantiles
+
+
+def sketch_column_star(args):
+    '''
+    sketch_column for a (column, kind) pair (used by the processes of profile_chunks).
+    '''
+    return sketch_column(*args)
+
+
+def profile_chunks(chunks, n_jobs=1):
+    '''
+    The approximate version of profile_features for data that need not fit in memory: given an iterable of chunks
+    (such as the x_data of iter_data), it profiles each into mergeable sketches (HyperLogLog for the number of unique
+    values and DDSketch for the quartiles and outlier ratio) and merges them, so memory stays bounded however many rows
+    there are. Nulls are counted exactly. The result also has the error bounds of the estimates: uniques_error is the
+    relative standard error of uniques and quantile_error is the relative error bound of the quartiles.
+    '''
+    kinds, sketches, num_rows = {}, {}, 0
+    # one pool for all the chunks rather than starting processes for each
+    with Pool(n_jobs) if n_jobs > 1 else nullcontext() as pool:
+        for x_data in chunks:
+            kinds.update({column: get_kind(x_data, column) for column in x_data.columns if column not in kinds})
+            args = [(x_data[column], kinds[column]) for column in x_data.columns]
+            if pool is not None:
+                results = pool.map(sketch_column_star, args)
+            else:
+                results = [sketch_column(*arg) for arg in args]
+            for column, (registers, nulls, quantiles) in zip(x_data.columns, results):
+                if column not in sketches:
+                    sketches[column] = [registers, nulls, quantiles]
+                    continue
+                merged = sketches[column]
+                merged[0] = np.maximum(merged[0], registers)
+                merged[1] += nulls
+                merged[2] = merge_quantile_sketches(merged[2], quantiles) if quantiles is not None else None
+            num_rows += len(x_data)
+
+    rows = []
+    for column, (registers, nulls, quantiles) in sketches.items():
+        uniques = hll_estimate(registers)
+        row = [get_type(kinds[column], uniques, column), uniques, nulls, nulls / num_rows if num_rows else 0.0]
+        if quantiles is None:
+            row += [np.nan] * 5
+        else:
+            q1, median, q3 = sketch_quantiles(quantiles, [0.25, 0.5, 0.75])
+            # the count of the values in buckets above the fence
+            upper = q3 + 3 * (q3 - q1)
+            outliers = quantiles[get_bucket_values(quantiles.index.to_numpy()) > upper].sum()
+            row += [q1, median, q3, q3 - q1, outliers / num_rows if num_rows else 0.0]
+        rows.append(row)
+    columns = ['type', 'uniques', 'nulls', 'nulls_ratio', 'q1', 'median', 'q3', 'iqr', 'outlier_ratio']
+    profile = pd.DataFrame(rows, index=list(sketches), columns=columns)
+    profile['uniques_error'] = 1.04 / np.sqrt(2**HLL_PRECISION)
+    profile['quantile_error'] = QUANTILE_ACCURACY
+    return profile
+
+
+def get_profile_table(profile):
+    '''
+    Given the result of profile_features, it returns the dictionary that nice_table renders (one row per feature).
+    '''
+    column_dict = {}
+    for column, row in profile.iterrows():
+        nulls_ratio = str(round(round(row['nulls_ratio'], 2) * 100, 2)) + '%'
+        # features that can't have outliers have none
+        outlier_ratio = 0 if np.isnan(row['outlier_ratio']) else row['outlier_ratio']
+        outlier_ratio = str(round(outlier_ratio * 100, 2)) + '%'
+        column_dict[column] = [row['type'], row['uniques'], nulls_ratio, outlier_ratio]
+    return column_dict
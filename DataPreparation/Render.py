@@ -0,0 +1,211 @@
+import os
+import sys
+import ast
+import json
+import hashlib
+import importlib.util
+from multiprocessing import Pool
+import matplotlib
+from DataPreparation.Preprocess import read_data, ensure_split, ensure_cache, get_split_path, file_fingerprint
+
+# the root of the repository (the paths of the modules of the figures are relative to it)
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# the figures of the report; each is drawn by calling function of module (a path relative to the root) with the
+# dataset read by read_data(**data) and the keyword arguments args; if the figure has prepare, the dataset is first
+# passed through those functions of the module in order (as its notebook does)
+REPORT_FIGURES = [
+    {'name': 'feature-histograms', 'module': 'DataPreparation/Visualize.py', 'function': 'plot_feature_histograms',
+     'data': {'kind': 'all', 'fix': True}, 'args': {}},
+    {'name': 'violin-plots', 'module': 'DataPreparation/Visualize.py', 'function': 'plot_violin_plots',
+     'data': {'kind': 'all', 'fix': True}, 'args': {}},
+    {'name': 'continuous-density', 'module': 'DataPreparation/Visualize.py', 'function': 'visualize_continuous_data',
+     'data': {'kind': 'all', 'fix': True}, 'args': {'density': True, 'log_scale': True}},
+    {'name': 'correlation-matrix', 'module': 'DataPreparation/Visualize.py', 'function': 'correlation_matrix',
+     'data': {'kind': 'all', 'fix': True}, 'args': {}},
+    {'name': 'licenses', 'module': 'Questions/D - License Prevalence/Logic.py', 'function': 'explore_license',
+     'data': {'kind': 'all', 'fix': True}, 'args': {}},
+    {'name': 'license-fractions', 'module': 'Questions/D - License Prevalence/Logic.py', 'function': 'fraction_of_license',
+     'data': {'kind': 'all', 'fix': True}, 'args': {}},
+    {'name': 'top-licenses', 'module': 'Questions/D - License Prevalence/Logic.py', 'function': 'top_10_licenses',
+     'data': {'kind': 'all', 'fix': True}, 'args': {}},
+    {'name': 'stars-outliers', 'module': 'Questions/D - Language Success/Logic.py', 'function': 'outliers_pie_plot',
+     'data': {'kind': 'all', 'fix': True}, 'args': {}},
+    {'name': 'license-correlation', 'module': 'Questions/E - Licenses, Language & Size/Logic.py', 'function': 'Plot_Correlation',
+     'data': {'kind': 'all', 'fix': True}, 'args': {}},
+    {'name': 'stars-per-language', 'module': 'Questions/D - Language Success/Logic.py', 'function': 'stars_per_languages',
+     'data': {'kind': 'all', 'fix': True}, 'args': {}},
+    {'name': 'yearly-stars-per-language', 'module': 'Questions/D - Language Success/Logic.py', 'function': 'yearly_stars_distribution_per_language',
+     'data': {'kind': 'all', 'fix': True}, 'args': {}},
+    {'name': 'size-top-languages', 'module': 'Questions/E - Licenses, Language & Size/Logic.py', 'function': 'plot_top_n_languages',
+     'data': {'kind': 'all', 'fix': True}, 'prepare': ['preprocess_data'], 'args': {}},
+    {'name': 'size-top-licenses', 'module': 'Questions/E - Licenses, Language & Size/Logic.py', 'function': 'plot_top_n_licenses',
+     'data': {'kind': 'all', 'fix': True}, 'prepare': ['preprocess_data'], 'args': {}},
+    {'name': 'disk-usages', 'module': 'Questions/E - Licenses, Language & Size/Logic.py', 'function': 'plot_diskUsages',
+     'data': {'kind': 'all', 'fix': True}, 'prepare': ['preprocess_data'], 'args': {}},
+    {'name': 'license-size', 'module': 'Questions/E - Licenses, Language & Size/Logic.py', 'function': 'plot_license_with_project_size',
+     'data': {'kind': 'all', 'fix': True}, 'prepare': ['preprocess_data'], 'args': {}},
+    {'name': 'license-language', 'module': 'Questions/E - Licenses, Language & Size/Logic.py', 'function': 'plot_licence_with_language',
+     'data': {'kind': 'all', 'fix': True}, 'prepare': ['preprocess_data'], 'args': {}},
+    {'name': 'language-size', 'module': 'Questions/E - Licenses, Language & Size/Logic.py', 'function': 'plot_project_size_with_language',
+     'data': {'kind': 'all', 'fix': True}, 'prepare': ['preprocess_data'], 'args': {}},
+    {'name': 'license-size-statistics', 'module': 'Questions/E - Licenses, Language & Size/Logic.py', 'function': 'get_statistics_for_license_with_disk_usage',
+     'data': {'kind': 'all', 'fix': True}, 'prepare': ['preprocess_data'], 'args': {}},
+    {'name': 'python-pull-requests', 'module': 'Questions/P - Expected Python Contributions/Logic.py', 'function': 'plot_data',
+     'data': {'kind': 'all', 'fix': False}, 'prepare': ['preprocess_data', 'explore_data'], 'args': {}},
+]
+
+
+def load_function(module, function):
+    '''
+    Imports the module at the given path (relative to the root) and returns its function with the given name.
+    '''
+    path = os.path.join(ROOT_DIR, module)
+    # the modules of the questions are all called Logic so each is given a name of its own
+    name = 'render_' + hashlib.md5(module.encode()).hexdigest()
+    if name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(name, path)
+        sys.modules[name] = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(sys.modules[name])
+    return getattr(sys.modules[name], function)
+
+
+def get_module_dependencies(module):
+    '''
+    Given the path of a module (relative to the root), returns the sorted paths (relative to the root) of it and of
+    every module of the repository it imports, directly or not. Imports are resolved against the root and the
+    module's own folder (the notebooks import their Logic from there); other imports are of installed packages.
+    '''
+    found, stack = set(), [module]
+    while stack:
+        module = stack.pop()
+        if module in found:
+            continue
+        found.add(module)
+        with open(os.path.join(ROOT_DIR, module)) as file:
+            tree = ast.parse(file.read())
+        names = []
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names += [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                # the imported names may be modules of the package too
+                names += [node.module] + [f'{node.module}.{alias.name}' for alias in node.names]
+        for name in names:
+            for base in ['', os.path.dirname(module)]:
+                path = os.path.join(base, *name.split('.')) + '.py'
+                if os.path.isfile(os.path.join(ROOT_DIR, path)):
+                    stack.append(os.path.normpath(path))
+                    break
+    return sorted(found)
+
+
+def get_figure_fingerprint(figure):
+    '''
+    The fingerprint of the inputs of a figure: its specification, the code of its module and of every module of
+    the repository it imports (see get_module_dependencies) and the fingerprint of the dataset it reads. read_data
+    (and so Preprocess.py and what it imports) is always a dependency.
+    '''
+    digest = hashlib.blake2b(json.dumps(figure, sort_keys=True).encode())
+    modules = set(get_module_dependencies(figure['module'])) | set(get_module_dependencies('DataPreparation/Render.py'))
+    for module in sorted(modules):
+        digest.update(module.encode())
+        with open(os.path.join(ROOT_DIR, module), 'rb') as file:
+            digest.update(file.read())
+    digest.update(file_fingerprint(get_split_path(figure['data'].get('split', 'train'))).encode())
+    return digest.hexdigest()
+
+
+def render_figure(figure, out_dir, formats=('png',)):
+    '''
+    Draws a figure headlessly (on the Agg backend) and saves each matplotlib figure it shows to out_dir as
+    <name>-<i>.<format> for each of the given formats. Returns the paths of the saved files and the error that
+    stopped drawing the figure (None if it was drawn).
+    '''
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    sys.path.append(ROOT_DIR)
+    # each figure starts from the default style (the functions set the style and dpi globally)
+    plt.rcdefaults()
+    plt.close('all')
+    paths = []
+
+    def save_figures(*args, **kwargs):
+        for num in plt.get_fignums():
+            for fmt in formats:
+                path = os.path.join(out_dir, f"{figure['name']}-{len(paths) // len(formats)}.{fmt}")
+                plt.figure(num).savefig(path, format=fmt, bbox_inches='tight')
+                paths.append(path)
+        plt.close('all')
+
+    show = plt.show
+    plt.show = save_figures
+    try:
+        function = load_function(figure['module'], figure['function'])
+        x_data, _ = read_data(**figure['data'])
+        for prepare in figure.get('prepare', []):
+            x_data = load_function(figure['module'], prepare)(x_data)
+        function(x_data, **figure['args'])
+        # figures that were drawn but not shown
+        save_figures()
+    except Exception as error:
+        # one broken figure shouldn't stop the rest of the report
+        plt.close('all')
+        return paths, f'{type(error).__name__}: {error}'
+    finally:
+        plt.show = show
+    return paths, None
+
+
+def render_figures(figures=REPORT_FIGURES, out_dir=os.path.join(ROOT_DIR, 'Reports & Dashboard', 'figures'), formats=('png',), n_jobs=None, force=False):
+    '''
+    Renders the given figures (see REPORT_FIGURES) to out_dir in parallel by n_jobs processes (all the cores by
+    default). A figure whose fingerprint (see get_figure_fingerprint) didn't change since it was last rendered there
+    is skipped unless force. Returns the names of the rendered figures (the ones that failed are reported and
+    rendered again next time).
+    '''
+    os.makedirs(out_dir, exist_ok=True)
+    # split once here rather than in each process
+    ensure_split()
+    manifest_path = os.path.join(out_dir, 'manifest.json')
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+
+    fingerprints = {figure['name']: get_figure_fingerprint(figure) for figure in figures}
+
+    def is_current(figure):
+        entry = manifest.get(figure['name'])
+        return (entry is not None and entry['fingerprint'] == fingerprints[figure['name']]
+                and entry['formats'] == list(formats) and all(os.path.exists(path) for path in entry['paths']))
+    stale = [figure for figure in figures if force or not is_current(figure)]
+
+    # the caches of the splits the figures read are built here too; the processes would all build them at once
+    for split in {figure['data'].get('split', 'train') for figure in stale}:
+        ensure_cache(get_split_path(split))
+
+    args = [(figure, out_dir, formats) for figure in stale]
+    n_jobs = min(len(stale), n_jobs or os.cpu_count())
+    if n_jobs > 1:
+        with Pool(n_jobs) as pool:
+            results = pool.starmap(render_figure, args)
+    else:
+        results = [render_figure(*arg) for arg in args]
+
+    rendered = []
+    for figure, (paths, error) in zip(stale, results):
+        if error is not None:
+            print(f"Failed to render {figure['name']}: {error}")
+            manifest.pop(figure['name'], None)
+            continue
+        manifest[figure['name']] = {'fingerprint': fingerprints[figure['name']], 'formats': list(formats), 'paths': paths}
+        rendered.append(figure['name'])
+    with open(manifest_path, 'w') as file:
+        json.dump(manifest, file, indent=2)
+    return rendered
+
+
+if __name__ == '__main__':
+    sys.path.append(ROOT_DIR)
+    print('Rendered:', render_figures())
@@ -0,0 +1,101 @@
+import pandas as pd
+
+# The declared kind of each column of the GitHub metadata dataset:
+#   category:  few distinct labels, stored as a pandas categorical (missing values are the "-1" category)
+#   text:      free text or identifiers, stored as strings (missing values are "-1")
+#   count:     non-negative integers, stored in the nullable signed width declared in COUNT_DTYPES (so arithmetic on
+#              them can go negative, every split and chunk has the same dtype and missing values stay missing)
+#   flag:      booleans
+#   date:      UTC timestamps
+#   composite: strings that pack several values (e.g., the languages used and their sizes)
+SCHEMA = {
+    'owner': 'text',
+    'name': 'text',
+    'nameWithOwner': 'text',
+    'description': 'text',
+    'parent': 'text',
+    'stars': 'count',
+    'forks': 'count',
+    'watchers': 'count',
+    'diskUsageKb': 'count',
+    'pullRequests': 'count',
+    'defaultBranchCommitCount': 'count',
+    'assignableUserCount': 'count',
+    'isFork': 'flag',
+    'isArchived': 'flag',
+    'forkingAllowed': 'flag',
+    'primaryLanguage': 'category',
+    'license': 'category',
+    'codeOfConduct': 'category',
+    'createdAt': 'date',
+    'pushedAt': 'date',
+    'languages': 'composite',
+    'languagesUsed': 'composite',
+    'languagesSizes': 'composite',
+}
+
+# the dtype of each count column: a nullable (Int) signed width that fits its values so that any of them can be missing
+COUNT_DTYPES = {
+    'stars': 'Int32',
+    'forks': 'Int32',
+    'watchers': 'Int32',
+    'diskUsageKb': 'Int64',
+    'pullRequests': 'Int32',
+    'defaultBranchCommitCount': 'Int64',
+    'assignableUserCount': 'Int32',
+}
+
+# the label that stands for a missing value in categorical and text columns
+MISSING_LABEL = '-1'
+
+
+def get_kind(x_data, col):
+    '''
+    Returns the kind of the given column; from the schema if declared there, otherwise inferred from its dtype
+    (number for numeric columns like those made by get_date_features, date for timestamps and text otherwise).
+    '''
+    if col in SCHEMA:
+        return SCHEMA[col]
+    dtype = x_data[col].dtype
+    if pd.api.types.is_bool_dtype(dtype):
+        return 'flag'
+    if pd.api.types.is_numeric_dtype(dtype):
+        return 'number'
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return 'date'
+    if isinstance(dtype, pd.CategoricalDtype):
+        return 'category'
+    return 'text'
+
+
+def is_categorical(x_data, col):
+    '''
+    Whether the column holds labels (categories, text or composite strings) rather than quantities or dates.
+    '''
+    return get_kind(x_data, col) in ['category', 'text', 'composite']
+
+
+def is_numerical(x_data, col):
+    '''
+    Whether the column holds quantities (counts, other numbers or flags).
+    '''
+    return get_kind(x_data, col) in ['count', 'number', 'flag']
+
+
+def apply_schema(ds):
+    '''
+    Casts every column of the dataset to the compact dtype of its declared kind.
+    '''
+    for col in ds.columns:
+        kind = get_kind(ds, col)
+        if kind in ['category', 'text', 'composite']:
+            # missing values become "-1" (all-missing columns could have been read as floats)
+            labels = ds[col].astype(object).where(ds[col].notna(), MISSING_LABEL).astype(str)
+            ds[col] = labels.astype('category') if kind == 'category' else labels
+        elif kind == 'count':
+            ds[col] = ds[col].astype(COUNT_DTYPES[col])
+        elif kind == 'flag':
+            ds[col] = ds[col].fillna(False).astype(bool)
+        elif kind == 'date':
+            ds[col] = pd.to_datetime(ds[col], utc=True)
+    return ds
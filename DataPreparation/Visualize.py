@@ -1,4 +1,5 @@
 import matplotlib.pyplot as plt
+from matplotlib.colors import LogNorm
 import pandas as pd
 import numpy as np
 import seaborn as sns
@@ -6,8 +7,12 @@ from IPython.display import display, HTML, Markdown, Latex
 import sys
 sys.path.append('../')
 from utils import nice_table
+from DataPreparation.Schema import get_kind, is_categorical, is_numerical
+from DataPreparation.Profile import profile_features, profile_chunks, get_profile_table
+from DataPreparation.Preprocess import stream_correlation, get_digest
 from tqdm import tqdm
 import itertools
+from collections import OrderedDict
 
 def basic_info(x_data):
     '''
@@ -19,51 +24,83 @@ def basic_info(x_data):
     display(HTML(nice_table(dic, title='Basic Counts')))
 
 
-def features_info(x_data):
+def features_info(x_data, n_jobs=1, approximate=False, chunksize=100_000):
     '''
     prints info about the features like the type, number of unique values, missing values ratio.
+    The features are profiled in one pass (see profile_features). If approximate, they are profiled chunk by chunk
+    into sketches (see profile_chunks) and x_data may also be an iterable of chunks (such as the x_data of iter_data).
     '''
-    column_dict = {}
-    for column in x_data.columns:  
-        num_uniques = x_data[column].nunique()
-        # counts nulls which were replaced by -1 or "-1" depending on the type
-        num_nulls = sum(x_data[column] == -1) + sum(x_data[column] == '-1')
-        nulls_ratio = round(num_nulls / len(x_data), 2)
-        # outlier condition is median + 3 * IQR; lets count the number of outliers
-        if type(x_data.iloc[0, x_data.columns.get_loc(column)]) == str:
-            outlier_ratio = 0
-        else:
-            Q1, Q3 = x_data[column].quantile(0.25), x_data[column].quantile(0.75)
-            iqr = Q3 - Q1
-            outlier_ratio = sum(x_data[column] > Q3 + 3 * iqr) / len(x_data)
-        kind = 'Categorical' if type(x_data.iloc[0, x_data.columns.get_loc(column)]) == str else 'Numerical'
-        kind = 'Date' if x_data[column].dtype == 'datetime64[ns, UTC]' else kind
-        kind = 'Binary' if num_uniques == 2 else kind
-        kind = 'Constant' if num_uniques == 1 else kind
-        kind = 'Useless' if num_uniques == 0 else kind
-        kind = 'Composite' if column in ['languagesUsed', 'languagesSizes'] else kind
-        
-        nulls_ratio, outlier_ratio = str(round(nulls_ratio*100,2)) + '%', str(round(outlier_ratio*100,2)) + '%'
-        column_dict[column] = [kind, num_uniques, nulls_ratio, outlier_ratio]
-        
-    display(HTML(nice_table(column_dict, title='Features Types, Uniques Count, Missing Ratio, Outlier Ratio')))
+    title = 'Features Types, Uniques Count, Missing Ratio, Outlier Ratio'
+    if not approximate:
+        column_dict = get_profile_table(profile_features(x_data, n_jobs))
+        display(HTML(nice_table(column_dict, title=title)))
+        return
+
+    chunks = x_data
+    if isinstance(x_data, pd.DataFrame):
+        chunks = (x_data.iloc[i:i + chunksize] for i in range(0, len(x_data), chunksize))
+    profile = profile_chunks(chunks, n_jobs)
+    errors = f"uniques ±{profile['uniques_error'].iloc[0]:.1%}, quantiles ±{profile['quantile_error'].iloc[0]:.0%}"
+    display(HTML(nice_table(get_profile_table(profile), title=f'{title} (approximate: {errors})')))
+
+
+
+
+# bin counts computed by get_histogram (least recently used first) keyed by the column, the digest of its values and the
+# binning, and the number of them kept at most
+HISTOGRAM_CACHE = OrderedDict()
+HISTOGRAM_CACHE_SIZE = 256
+
+
+def get_histogram(x_data, feat, bins=50, log_counts=True):
+    '''
+    Returns the histogram of a feature over the full dataset as (counts, edges, label). Categorical features are
+    given integer labels by frequency (most frequent first), dates are binned as fractional years and, if
+    log_counts, counts (heavy-tailed like stars and forks) are binned by log(1 + value); label names the binned
+    quantity. The counts are cached for the values of the feature (the HISTOGRAM_CACHE_SIZE most recently used).
+    '''
+    col = x_data[feat]
+    # the dtype decides how the values are binned
+    key = (feat, str(col.dtype), get_digest(col), bins, log_counts)
+    if key in HISTOGRAM_CACHE:
+        HISTOGRAM_CACHE.move_to_end(key)
+    else:
+        HISTOGRAM_CACHE[key] = compute_histogram(x_data, feat, bins, log_counts)
+        if len(HISTOGRAM_CACHE) > HISTOGRAM_CACHE_SIZE:
+            HISTOGRAM_CACHE.popitem(last=False)
+    return HISTOGRAM_CACHE[key]
 
 
+def compute_histogram(x_data, feat, bins=50, log_counts=True):
+    '''
+    Computes the histogram of a feature that get_histogram returns.
+    '''
+    col = x_data[feat]
+    if is_categorical(x_data, feat):
+        # the counts of the labels (most frequent first) summed over groups of consecutive labels
+        label_counts = col.value_counts(dropna=False).to_numpy()
+        label_counts = label_counts[label_counts > 0]
+        edges = np.unique(np.linspace(0, len(label_counts), min(bins, len(label_counts)) + 1).astype(int))
+        counts = np.add.reduceat(label_counts, edges[:-1]) if len(label_counts) else np.zeros(0, dtype=int)
+        label = feat + ' (label)'
+    else:
+        values = get_bin_values(x_data, feat, log_counts)
+        counts, edges = np.histogram(values[~np.isnan(values)], bins=bins)
+        label = get_axis_label(x_data, feat, log_counts)
+    return counts, edges.astype(float), label
 
 
-def plot_feature_histograms(x_data, sample_size):
+def plot_feature_histograms(x_data, sample_size=None, bins=50, log_counts=True):
     '''
     Plots a histogram for each feature. It gives integer labels to categorical features before plotting.
+    The histograms are of the full dataset (see get_histogram) unless a sample_size is given.
     '''
     # drop languages_used, language_sizes, and createdAt
     x_data = x_data.drop(['languagesUsed', 'languagesSizes'], axis=1)
 
-    # get a random sample of 1000 rows
-    x_data = x_data.sample(sample_size)
-    # for each categorical column, factorize it
-    for feat in x_data.columns:
-        if type(x_data.iloc[0, x_data.columns.get_loc(feat)]) == str:
-            x_data[feat] = pd.factorize(x_data[feat])[0]
+    # get a random sample of rows
+    if sample_size is not None:
+        x_data = x_data.sample(sample_size)
 
     # get the number of rows and columns needed
     num_rows = len(x_data.columns) // 4 + 1
@@ -80,10 +117,12 @@ def plot_feature_histograms(x_data, sample_size):
     for i, feat in tqdm(enumerate(x_data.columns)):
         # get the row and column index
         row, col = i // num_cols, i % num_cols
-        # make the histogram
-        axes[row, col].hist(x_data[feat], bins=50)
+        # draw the histogram from its bin counts
+        counts, edges, label = get_histogram(x_data, feat, bins, log_counts)
+        if len(counts):
+            axes[row, col].hist(edges[:-1], bins=edges, weights=counts)
         axes[row, col].set_title(feat)
-        axes[row, col].set_xlabel(feat)
+        axes[row, col].set_xlabel(label)
         axes[row, col].set_ylabel('Frequency')
         # add hspace
         fig.subplots_adjust(hspace=0.5)
@@ -97,27 +136,27 @@ def plot_feature_histograms(x_data, sample_size):
     
 
 # make violin plots
-def plot_violin_plots(x_data, sample_size):
+def plot_violin_plots(x_data, sample_size=None, bins=50, log_counts=True):
     '''
     Plots violin plots for each feature. It gives integer labels to categorical features before plotting.
+    The violins are drawn from the same (cached) histograms as plot_feature_histograms.
     '''
     # drop languages_used, language_sizes, and createdAt
     x_data = x_data.drop(['languagesUsed', 'languagesSizes', 'createdAt'], axis=1)
 
     # get a random sample of rows
-    x_data = x_data.sample(sample_size)
-    # for each categorical column, factorize it
-    for feat in x_data.columns:
-        if type(x_data.iloc[0, x_data.columns.get_loc(feat)]) == str:
-            x_data[feat] = pd.factorize(x_data[feat])[0]
+    if sample_size is not None:
+        x_data = x_data.sample(sample_size)
 
     # plot violin plots
     num_cols = 4
     num_rows = len(x_data.columns) // num_cols + 1
     fig, axes = plt.subplots(num_rows, num_cols, figsize=(20, 20))
     for i, feat in enumerate(x_data.columns):
-        col = pd.DataFrame(x_data[feat])
-        sns.violinplot(col, ax=axes[i // num_cols, i % num_cols], color='#FDFD96')
+        counts, edges, label = get_histogram(x_data, feat, bins, log_counts)
+        draw_violin(axes[i // num_cols, i % num_cols], counts, edges, color='#FDFD96')
+        axes[i // num_cols, i % num_cols].set_xlabel(feat)
+        axes[i // num_cols, i % num_cols].set_ylabel(label)
     
     # remove remaining plots
     for i in range(len(x_data.columns), num_rows * num_cols):
@@ -126,20 +165,42 @@ def plot_violin_plots(x_data, sample_size):
     plt.show()
 
 
+def draw_violin(ax, counts, edges, color='#FDFD96'):
+    '''
+    Draws a violin on ax from the bin counts of a histogram: its width at each bin center is the (peak-normalized)
+    density of the bin.
+    '''
+    ax.set_xticks([])
+    if not len(counts) or not counts.max():
+        return
+    centers = (edges[:-1] + edges[1:]) / 2
+    density = counts / (edges[1:] - edges[:-1])
+    width = 0.4 * density / density.max()
+    ax.fill_betweenx(centers, -width, width, color=color, alpha=0.8, linewidth=0)
+    ax.set_xlim(-0.5, 0.5)
 
 
-def visualize_continuous_data(x_data, sample_size=10000):
+
+
+def visualize_continuous_data(x_data, sample_size=10000, density=False, bins=50, log_scale=False):
     '''
     Plot a grid of scatter plots for each pair of continuous features.
+    If density, the full dataset is binned instead and each pair is drawn as the image of its 2-D histogram (see
+    get_pair_counts) so the time it takes depends on bins rather than the number of rows; log_scale then bins the
+    counts (e.g., stars and forks) by log(1 + value) and colors the histograms on a log scale.
     '''
     # get sample
-    x_data = x_data.sample(sample_size)
+    if not density:
+        x_data = x_data.sample(sample_size)
     
-    # get only the continuous features
-    cont_feats = [feat for feat in x_data.columns if type(x_data.iloc[0, x_data.columns.get_loc(feat)]) != str]
+    # get only the continuous features (missing values become NaN and are not drawn)
+    cont_feats = [feat for feat in x_data.columns if not is_categorical(x_data, feat)]
     x_data_cont = x_data[cont_feats]
     # execlude the isArchived column
     x_data_cont = x_data_cont.drop('isArchived', axis=1)
+    for feat in x_data_cont.columns:
+        if get_kind(x_data_cont, feat) != 'date':
+            x_data_cont[feat] = x_data_cont[feat].astype(float)
     
     print("Number of continuous features:", len(x_data_cont.columns))
     
@@ -148,6 +209,10 @@ def visualize_continuous_data(x_data, sample_size=10000):
     
     num_rows = len(combinations) // 4 + 1
     num_cols = 4
+
+    if density:
+        indices, edges = get_bin_indices(x_data_cont, bins, log_scale)
+        positions = {feat: i for i, feat in enumerate(x_data_cont.columns)}
      
     # plot each combination of 2 features the grid
     plt.rcParams['figure.dpi'] = 300        # increase plot resolution
@@ -155,10 +220,18 @@ def visualize_continuous_data(x_data, sample_size=10000):
     for i, (feat1, feat2) in tqdm(enumerate(combinations)):
         # get the row and column index
         row, col = i // num_cols, i % num_cols
-        # plot the scatter plot
-        axes[row, col].scatter(x_data_cont[feat1], x_data_cont[feat2], s=1)
-        axes[row, col].set_xlabel(feat1)
-        axes[row, col].set_ylabel(feat2)
+        if density:
+            # plot the 2-D histogram as an image (feat1 on the x-axis)
+            i1, i2 = positions[feat1], positions[feat2]
+            counts = get_pair_counts(indices[:, i1], indices[:, i2], bins)
+            extent = [edges[i1][0], edges[i1][-1], edges[i2][0], edges[i2][-1]]
+            norm = LogNorm() if log_scale else None
+            axes[row, col].imshow(np.ma.masked_equal(counts.T, 0), origin='lower', extent=extent, aspect='auto', norm=norm, interpolation='nearest')
+        else:
+            # plot the scatter plot
+            axes[row, col].scatter(x_data_cont[feat1], x_data_cont[feat2], s=1)
+        axes[row, col].set_xlabel(get_axis_label(x_data_cont, feat1, density and log_scale))
+        axes[row, col].set_ylabel(get_axis_label(x_data_cont, feat2, density and log_scale))
         axes[row, col].set_title(feat1 + " vs " + feat2)
         fig.subplots_adjust(hspace=0.8)
         
@@ -168,6 +241,55 @@ def visualize_continuous_data(x_data, sample_size=10000):
         fig.delaxes(axes[i // num_cols, i % num_cols])
         
     plt.show()
+
+
+def get_bin_values(x_data_cont, feat, log_scale=False):
+    '''
+    The values of a continuous feature as floats to bin: dates become fractional years and, if log_scale, counts
+    become log(1 + count).
+    '''
+    col = x_data_cont[feat]
+    if get_kind(x_data_cont, feat) == 'date':
+        return (col.dt.year + (col.dt.dayofyear - 1) / 365.25).to_numpy(dtype=float, na_value=np.nan)
+    values = col.to_numpy(dtype=float, na_value=np.nan)
+    return np.log1p(values) if log_scale and get_kind(x_data_cont, feat) == 'count' else values
+
+
+def get_axis_label(x_data_cont, feat, log_scale=False):
+    '''
+    The axis label of a continuous feature binned by get_bin_values.
+    '''
+    if get_kind(x_data_cont, feat) == 'date':
+        return feat + ' (year)'
+    return f'log(1 + {feat})' if log_scale and get_kind(x_data_cont, feat) == 'count' else feat
+
+
+def get_bin_indices(x_data_cont, bins=50, log_scale=False):
+    '''
+    Bins every continuous feature once into bins equal-width bins over its range. Returns an array with the bin of
+    each value (rows x features; -1 for missing values) and the bin edges of each feature.
+    '''
+    indices = np.full((len(x_data_cont), len(x_data_cont.columns)), -1, dtype=np.int32)
+    edges = []
+    for i, feat in enumerate(x_data_cont.columns):
+        values = get_bin_values(x_data_cont, feat, log_scale)
+        present = ~np.isnan(values)
+        low, high = (values[present].min(), values[present].max()) if present.any() else (0.0, 1.0)
+        high = high if high > low else low + 1
+        edges.append(np.linspace(low, high, bins + 1))
+        # the maximum goes to the last bin
+        indices[present, i] = np.minimum(((values[present] - low) / (high - low) * bins).astype(np.int32), bins - 1)
+    return indices, edges
+
+
+def get_pair_counts(indices1, indices2, bins=50):
+    '''
+    Given the bins of two features (see get_bin_indices), returns their 2-D histogram (bins x bins counts of the rows
+    where both are present).
+    '''
+    present = (indices1 >= 0) & (indices2 >= 0)
+    flat = indices1[present].astype(np.int64) * bins + indices2[present]
+    return np.bincount(flat, minlength=bins * bins).reshape(bins, bins)
     
     
 
@@ -184,24 +306,35 @@ def convey_insights(bullets_arr, title="Insights"):
     markdown_str += '</font>'
     display(Markdown(markdown_str))
 
-def correlation_matrix(x_data, sample_size=10000):
+def correlation_matrix(x_data, sample_size=None, method='pearson', chunksize=100_000):
     '''
     Plot a correlation matrix for continuous features.
+    It's computed over the full dataset (chunk by chunk, see stream_correlation) unless a sample_size is given; x_data
+    may also be an iterable of chunks (such as the x_data of iter_data). method is pearson or spearman.
     '''
 
-    # Get sample
-    x_data = x_data.sample(sample_size)
+    if isinstance(x_data, pd.DataFrame):
+        # Get sample
+        if sample_size is not None:
+            x_data = x_data.sample(sample_size)
+        chunks = (x_data.iloc[i:i + chunksize] for i in range(0, len(x_data), chunksize))
+    else:
+        chunks = x_data
 
-    # Get only the continuous features
-    cont_feats = [feat for feat in x_data.columns if type(x_data.iloc[0, x_data.columns.get_loc(feat)]) != str]
-    x_data_cont = x_data[cont_feats]
-    # Execlude the isArchived column
-    x_data_cont = x_data_cont.drop('isArchived', axis=1)
-    # Calculate the correlation matrix
-    corr_matrix = x_data_cont.corr()
+    # Calculate the correlation matrix of the continuous features (execluding the isArchived column)
+    corr_matrix = stream_correlation(get_continuous_chunks(chunks), method=method)
 
     # Plot the correlation matrix as a heatmap
     plt.figure(figsize=(12, 10))
     sns.heatmap(corr_matrix, annot=True, cmap="RdBu_r", fmt='.2f', linewidths=0.5, center=0, vmin=-1, vmax=1)
     plt.title("Correlation Matrix of Numerical Features")
     plt.show()
+
+
+def get_continuous_chunks(chunks):
+    '''
+    Yields the continuous features of each chunk (execluding the isArchived column).
+    '''
+    for x_data in chunks:
+        cont_feats = [feat for feat in x_data.columns if is_numerical(x_data, feat) and feat != 'isArchived']
+        yield x_data[cont_feats]
@@ -1,5 +1,6 @@
 ### contains implementations for functions to be used (directly called) in the notebook
 import pandas as pd
+from DataPreparation.Preprocess import build_cube, rollup, check_cube
 def explore_primary_languages(ds):
     '''
     Given a dataset, it returns a dataframe with the top_n primary languages and their counts.
@@ -25,13 +26,25 @@ def explore_primary_languages(ds):
 
     return unique_langs
 
-def get_top_used_languages_with_counts(ds, top_n , plot = True):
-    ds = ds.copy()
-    ds = ds[ds['primaryLanguage'] != '-1']
+def count_languages(ds, year=None, cube=None):
+    '''
+    Given a dataset, it returns the number of repositories of each primary language (except '-1') sorted descendingly; only the ones created in year if specified.
+    The counts are rolled up from the aggregate cube of the dataset (see build_cube); pass it as cube if it's already built (e.g., by read_cube) for the same (unfiltered) dataset (see check_cube).
+    '''
+    if cube is None:
+        cube = build_cube(ds)
+    else:
+        check_cube(cube, ds)
+    where = {} if year is None else {'year': year}
+    counts = rollup(cube, 'primaryLanguage', **where)['count']
+    counts = counts[(counts.index.astype(str) != '-1') & (counts > 0)]
+    return counts.sort_values(ascending=False, kind='stable')
+
+def get_top_used_languages_with_counts(ds, top_n , plot = True, cube = None):
     # get the counts of each language
-    lang_counts = ds['primaryLanguage'].value_counts()
+    lang_counts = count_languages(ds, cube=cube)
     # make a dataframe
-    lang_counts = pd.DataFrame({'language': lang_counts.index, 'count': lang_counts.values})
+    lang_counts = pd.DataFrame({'language': lang_counts.index.astype(str), 'count': lang_counts.values})
     # get the top_n languages
     top_langs = lang_counts.iloc[:top_n, :]
     if plot:
@@ -39,14 +52,11 @@ def get_top_used_languages_with_counts(ds, top_n , plot = True):
 
     return top_langs 
 
-def get_top_used_languages_with_counts_for_specific_year(ds, year , top_n , plot = True):
-    ds = ds.copy()
-    ds = ds[ds['primaryLanguage'] != '-1']
-    ds = ds[ds['year'] == year]
+def get_top_used_languages_with_counts_for_specific_year(ds, year , top_n , plot = True, cube = None):
     # get the counts of each language
-    lang_counts = ds['primaryLanguage'].value_counts()
+    lang_counts = count_languages(ds, year, cube)
     # make a dataframe
-    lang_counts = pd.DataFrame({'language': lang_counts.index, 'count': lang_counts.values})
+    lang_counts = pd.DataFrame({'language': lang_counts.index.astype(str), 'count': lang_counts.values})
     # get the top_n languages
     top_langs = lang_counts.iloc[:top_n, :]
     if plot:
@@ -54,12 +64,12 @@ def get_top_used_languages_with_counts_for_specific_year(ds, year , top_n , plot
 
     return top_langs
 
-def get_margins(ds):
-    first = get_top_used_languages_with_counts(ds, 1 , False)
+def get_margins(ds, cube = None):
+    first = get_top_used_languages_with_counts(ds, 1 , False, cube)
     first = first.iloc[0, 1]
-    second = get_top_used_languages_with_counts(ds, 2 , False)
+    second = get_top_used_languages_with_counts(ds, 2 , False, cube)
     second = second.iloc[1, 1]
-    third = get_top_used_languages_with_counts(ds, 3 , False)
+    third = get_top_used_languages_with_counts(ds, 3 , False, cube)
     third = third.iloc[2, 1]
 
     return first - second , second - third
@@ -1,6 +1,7 @@
 import matplotlib.pyplot as plt
 import numpy as np
 import seaborn as sns
+from DataPreparation.Preprocess import get_quartiles
 #plt.rcParams['figure.dpi'] = 100
 plt.style.use('dark_background')
 
@@ -16,10 +17,8 @@ def outliers_pie_plot(x_data_d):
   """
 
   stars = x_data_d['stars']
-  Q1, Q3 = stars.quantile(0.25), stars.quantile(0.75)
-  iqr = Q3 - Q1
-  outlier_ratio = sum(stars > Q3 + 1.5 * iqr) / len(stars)
-  outlier_ratio += sum(stars < Q1 - 1.5 * iqr) / len(stars)
+  Q1, Q3, iqr = get_quartiles(x_data_d, ['stars']).loc['stars', ['q1', 'q3', 'iqr']]
+  outlier_ratio = ((stars > Q3 + 1.5 * iqr) | (stars < Q1 - 1.5 * iqr)).sum() / len(stars)
 
   # Create figure and axes objects
   fig, ax = plt.subplots(figsize=(2, 2))
@@ -33,16 +32,12 @@ def outliers_pie_plot(x_data_d):
 
   plt.show()
 
-def remove_outliers(x_data, col):
+def remove_outliers(x_data, col='stars'):
   '''
     Removes outliers from the given column
   '''
-  q1 = x_data[col].quantile(0.25)
-  q3 = x_data[col].quantile(0.75)
-  iqr = q3 - q1
-  x_data = x_data[x_data[col] < q3 + 1.5 * iqr]
-  x_data = x_data[x_data[col] > q1 - 1.5 * iqr]
-  return x_data
+  q1, q3, iqr = get_quartiles(x_data, [col]).loc[col, ['q1', 'q3', 'iqr']]
+  return x_data[(x_data[col] < q3 + 1.5 * iqr) & (x_data[col] > q1 - 1.5 * iqr)]
 
 def replace_missing_with_document(x_data_d):
   return x_data_d.replace({'primaryLanguage': {'-1': 'Document'}})
@@ -1,4 +1,13 @@
 import matplotlib.pyplot as plt
+import pandas as pd
+from DataPreparation.Preprocess import stream_group_counts, stream_value_counts
+
+
+def get_chunks(x_data_d):
+    '''
+    Given a dataset of repos or an iterable of chunks of it (such as the x_data of iter_data), returns the chunks.
+    '''
+    return [x_data_d] if isinstance(x_data_d, pd.DataFrame) else x_data_d
 
 
 
@@ -62,19 +71,22 @@ def explore_license(x_data_d):
 
 def fraction_of_license(x_data_d):
     '''
-    Given a dataset of repos, find the fraction of repos with a license
+    Given a dataset of repos (or an iterable of chunks of it), find the fraction of repos with a license
     '''
-    # Find the number and ratio of present licenses 
-    num_present_license = x_data_d[x_data_d['license'] != '-1'].count()
-    license_ratio = num_present_license[0]/ len(x_data_d)
+    # Count the repos of each pair of license and code of conduct (in one pass over the chunks)
+    counts = stream_group_counts(get_chunks(x_data_d), ['license', 'codeOfConduct'])
+    has_license = counts.index.get_level_values('license') != '-1'
+    has_coc = counts.index.get_level_values('codeOfConduct') != '-1'
+    num_repos = counts.sum()
+
+    # Find the ratio of present licenses 
+    license_ratio = counts[has_license].sum() / num_repos
 
-    # Find the number and ratio of present codes of conduct where there's license
-    num_present_codes_licenses = x_data_d[(x_data_d['codeOfConduct'] != '-1') & (x_data_d['license'] != '-1')].count()
-    coc_license_ratio = num_present_codes_licenses[0] / len(x_data_d)
+    # Find the ratio of present codes of conduct where there's license
+    coc_license_ratio = counts[has_coc & has_license].sum() / num_repos
 
-    # Find the number and ratio of present codes of conduct where there's no license
-    num_present_codes_nolicense = x_data_d[(x_data_d['codeOfConduct'] != '-1') & (x_data_d['license'] == '-1')].count()
-    coc_nolicense_ratio = num_present_codes_nolicense[0] / len(x_data_d)
+    # Find the ratio of present codes of conduct where there's no license
+    coc_nolicense_ratio = counts[has_coc & ~has_license].sum() / num_repos
     
     # Plot three pie charts; one for each ratio and let the labels be below the pie charts
     plt.rcParams['figure.dpi'] = 200
@@ -94,10 +106,10 @@ def fraction_of_license(x_data_d):
     # Find the top 10 licenses and plot in a bar chart
 def top_10_licenses(x_data_d):
     '''
-    Given a dataset of repos, find the top 10 licenses and plot in a bar chart
+    Given a dataset of repos (or an iterable of chunks of it), find the top 10 licenses and plot in a bar chart
     '''
     # Find the top 10 licenses
-    top_10_licenses = x_data_d['license'].value_counts().head(12)    
+    top_10_licenses = stream_value_counts(get_chunks(x_data_d), 'license').head(12)    
     top_10_licenses.pop('-1')
     top_10_licenses.pop('Other')
     total_num_licenses = sum(top_10_licenses.values)
@@ -47,19 +47,17 @@ def visualize(map_year_data):
         plt.show()
 
 
-def get_top_k_programming_languages_over_time(data, k):
+def get_top_k_programming_languages_over_time(data, k, lang_table):
     ''''
     split the data into years and get the top k programming languages for each year
     '''
 
-    # make copy of the dataframe
-    data = data.copy()
-
     map_year_data = {}
 
     # loop over data and split it into years
-    for year in data['createdAt'].dt.year.unique():
-        map_year_data[year] = get_top_k_programming_languages(data[data['createdAt'].dt.year == year], k)
+    years = data['createdAt'].dt.year
+    for year in years.unique():
+        map_year_data[year] = get_top_k_programming_languages(data[years == year], k, lang_table)
 
 
     return map_year_data
@@ -72,59 +70,40 @@ def remove_zero_pull_requests(data):
     return data[data['pullRequests'] != 0]
 
 
-def get_top_k_programming_languages(data, k):
+def get_top_k_programming_languages(data, k, lang_table):
     '''
     Given a dataframe, it returns the top k programming languages used in the repositories. with average disk usage.
-    returns list of tuples (language, [number of pull requests, disk usage])
+    lang_table is the repo-language table of the split data was read from (see read_language_table); they're joined
+    by nameWithOwner so data must have it.
+    returns a dataframe with columns language, total pullRequests and average diskUsageKb
     '''
 
-    # make copy of the dataframe
-    data = data.copy()
-
     # remove rows with zero pull requests
     data = remove_zero_pull_requests(data)
 
-    # map each language to its total pull requests and total disk usage
-    language_prs_size = {}
-
-    for i in range(len(data)):
-        
-        primary_lang    = data.iloc[i]['primaryLanguage']
-        prs             = data.iloc[i]['pullRequests']    
-        languages_used  = data.iloc[i]['languagesUsed']
-        languages_sizes = data.iloc[i]['languagesSizes']
-
-        if len(languages_used) == 0 or len(languages_sizes) != len(languages_used):
-            continue
+    # the size of the primary language of each repository (repositories whose primary language isn't among
+    # their languages have none)
+    primary = lang_table[lang_table['is_primary'] & lang_table['nameWithOwner'].isin(data['nameWithOwner'])]
+    primary_lang_size = pd.Series(primary['bytes'].to_numpy() / 1024, index=primary['nameWithOwner'].to_numpy())  # convert to KB
+    has_size = data['nameWithOwner'].isin(primary_lang_size.index).to_numpy()
 
-        try:
-            primary_language_index = languages_used.index(primary_lang) 
-        except:
-            continue
+    # map each language to its total pull requests and total disk usage in one groupby
+    language_prs_size = pd.DataFrame({
+        'language': data['primaryLanguage'].astype(str)[has_size],
+        'prs': data['pullRequests'][has_size],
+        'size': primary_lang_size.reindex(data['nameWithOwner'][has_size]).to_numpy(),
+    }).groupby('language').sum()
 
-        # get the size of the primary language
-        primary_lang_size = languages_sizes[primary_language_index]
-
-        if primary_lang in language_prs_size:
-            language_prs_size[primary_lang][0] += prs
-            language_prs_size[primary_lang][1] += (primary_lang_size / 1024) # convert to KB
-        else:
-            language_prs_size[primary_lang] = [prs, primary_lang_size]
-
-    
     # sort the languages by number of pull requests
-    top_languages = sorted(language_prs_size.items(), key=lambda item: item[1][0], reverse=True)
+    top_languages = language_prs_size.sort_values('prs', ascending=False).head(k)
 
     # calculate the average disk usage
-    for i in range(min(k, len(top_languages))):
-        top_languages[i][1][1] /= data['primaryLanguage'].value_counts()[top_languages[i][0]]
-
-    # create an empty dataframe with three columns: language, total pull requests, average disk usage
-    top_languages_df = pd.DataFrame(columns=['language', 'total pullRequests', 'average diskUsageKb'])
+    num_repos = data['primaryLanguage'].astype(str).value_counts()
+    top_languages['size'] /= num_repos[top_languages.index]
 
-    # fill the dataframe with the top k languages
-    for i in range(min(k, len(top_languages))):
-        top_languages_df.loc[i] = [top_languages[i][0], top_languages[i][1][0], top_languages[i][1][1]]
+    # create a dataframe with three columns: language, total pull requests, average disk usage
+    top_languages_df = pd.DataFrame({'language': top_languages.index, 'total pullRequests': top_languages['prs'].to_numpy(),
+                                     'average diskUsageKb': top_languages['size'].to_numpy()})
 
     return top_languages_df
 
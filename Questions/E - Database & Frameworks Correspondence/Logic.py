@@ -3,6 +3,11 @@ import matplotlib.pyplot as plt
 import numpy as np
 import seaborn as sns
 import re
+import os
+import hashlib
+import pandas as pd
+from multiprocessing import Pool
+from scipy import sparse
 
 backend_frameworks = [
     'django','ruby', 'node','laravel', 'flask', 
@@ -22,35 +27,52 @@ sql_databases = ['mysql', 'postgresql', 'oracle', 'microsoft sql server', 'mssql
 nosql_databases = ['mongo', 'cassandra', 'redis', 'elasticsearch', 'couchbase', 'dynamodb', 'hbase', 'neo4j', 'firebase', 'couchdb', 'influxdb', 'arangodb', 'cockroachdb']
    
 
-def generate_regex(lst):
+# the families of technologies (as named in the parsed descriptions) and their terms
+technologies = {
+    'front_end': frontend_frameworks,
+    'back_end': backend_frameworks,
+    'no_sql': nosql_databases,
+    'sql': sql_databases,
+}
+
+# terms that stand for the same technology are reported by the first
+synonyms = {
+    'microsoft sql server': 'mssql',
+    'node': 'express',
+}
+
+
+def generate_matcher(technologies):
     '''
-    This function takes a list of strings and returns a list of regexes that match the strings in the list. but must be preceded by a non-word character.
+    This function takes the technologies and returns a single regex that finds the mentions of all their terms (each must be preceded by a non-word character) in one scan
+    and a dictionary that maps each term to the (family, technology) pairs it reports.
     '''
-    regexs = []
-    for item in lst:
-        regex = re.compile(r'(?<!\w)' + item)
-        regexs.append(regex)
-    return regexs
+    terms = sorted({term.lower() for family in technologies.values() for term in family}, key=len, reverse=True)
+    # a zero-width match at each position finds the longest term there (and overlapping mentions)
+    matcher = re.compile(r'(?<!\w)(?=(' + '|'.join(re.escape(term) for term in terms) + '))')
 
-# generate regex for each framework
-backend_frameworks_regex  = generate_regex(backend_frameworks)
-frontend_frameworks_regex = generate_regex(frontend_frameworks)
-sql_databases_regex       = generate_regex(sql_databases)
-nosql_databases_regex     = generate_regex(nosql_databases)
+    reports = {term: [] for term in terms}
+    for family, family_terms in technologies.items():
+        for term in family_terms:
+            # a term also reports the shorter terms it starts with
+            for longer in terms:
+                if longer.startswith(term.lower()):
+                    reports[longer].append((family, synonyms.get(term, term)))
+    return matcher, reports
 
+technologies_matcher, technologies_reports = generate_matcher(technologies)
 
-def handle_synonyms(arr, synonyms):
-            '''
-            This function takes an array and a list of synonyms and returns the array with the synonyms replaced with the first element in the list.
-            '''
-            pivot = synonyms[0]
 
-            for i in range(len(arr)):
-                if arr[i] in synonyms:
-                    arr[i] = pivot
-        
-            # remove duplicates
-            return list(set(arr))
+def get_mentions(matches):
+    '''
+    This function takes the terms found in a description and returns a dictionary that contains the technologies of each family (without duplicates) in the order of the lists.
+    '''
+    found = {family: set() for family in technologies}
+    for term in matches:
+        for family, technology in technologies_reports[term]:
+            found[family].add(technology)
+    order = {family: [synonyms.get(term, term) for term in family_terms] for family, family_terms in technologies.items()}
+    return {family: sorted(found[family], key=order[family].index) for family in technologies}
 
 
 def parse_description(description):
@@ -59,83 +81,269 @@ def parse_description(description):
         '''
         description = description.lower()
         description = description.replace('\n', ' ')
-        
-        front_end = []
-        back_end = []
-        no_sql = []
-        sql = []
 
-        for i, regex in enumerate(frontend_frameworks_regex):
-            if regex.search(description):
-                front_end.append(frontend_frameworks[i])
+        return get_mentions(technologies_matcher.findall(description))
 
-        for i, regex in enumerate(backend_frameworks_regex):
-            if regex.search(description):
-                back_end.append(backend_frameworks[i])
-        
-        for i, regex in enumerate(nosql_databases_regex):
-            if regex.search(description):
-                no_sql.append(nosql_databases[i])
 
-        for i, regex in enumerate(sql_databases_regex):
-            if regex.search(description):
-                sql.append(sql_databases[i])
+def parse_descriptions(descriptions):
+    '''
+    This function takes the description column and returns a dataframe with a column of the frameworks used in each description for each family (front_end, back_end, no_sql and sql).
+    '''
+    matches = descriptions.astype(str).str.lower().str.findall(technologies_matcher)
+    mentions = [get_mentions(row) for row in matches]
+    return pd.DataFrame(mentions, index=descriptions.index, columns=list(technologies))
 
 
-        sql = handle_synonyms(sql, ['mssql', 'microsoft sql server'])
+# the technologies of each family in the order of their bits in the tag masks (see tag_descriptions)
+technologies_bits = {family: list(dict.fromkeys(synonyms.get(term, term) for term in family_terms)) for family, family_terms in technologies.items()}
+# the masks have a bit per technology of a family so no family may have more than 64
+for family, names in technologies_bits.items():
+    assert len(names) <= 64, f'The {family} family has {len(names)} technologies but a tag mask holds at most 64'
 
-        back_end = handle_synonyms(back_end, ['express', 'node'])
+# the tags of the descriptions already tagged are kept in a file named after the version of the technologies
+tags_version = hashlib.md5(repr((technologies, synonyms)).encode()).hexdigest()[:8]
+tags_cache_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../DataFiles', f'technology-tags-{tags_version}.parquet')
 
-        return {
-            'front_end': front_end,
-            'back_end': back_end,
-            'no_sql': no_sql,
-            'sql': sql
-        }
 
-def extend_dataset_with_frameworks(ds):
+def tag_descriptions(descriptions):
     '''
-    This function takes a dataset and extends it with the frameworks used in the description of each job.
+    This function takes descriptions and returns a dataframe with a bitmask (uint64) of the technologies of each family mentioned in each (bit i is the i-th technology of technologies_bits).
     '''
- 
-    ds = ds.copy()
+    parsed = parse_descriptions(descriptions)
+    masks = {}
+    for family, names in technologies_bits.items():
+        bits = {name: 1 << i for i, name in enumerate(names)}
+        masks[family] = np.array([sum(bits[name] for name in row) for row in parsed[family]], dtype=np.uint64)
+    return pd.DataFrame(masks, index=descriptions.index)
 
-    back_ends = []
-    front_ends = []
-    no_sqls = []
-    sqls = []
 
-    rows_to_be_removed = []
+def tag_dataset(descriptions, n_jobs=1, chunksize=50_000):
+    '''
+    This function takes the description column and returns the bitmasks of tag_descriptions for each row. The descriptions are identified by their hash and only the ones not
+    in the cache file (tags_cache_path) are tagged; in chunks of chunksize by n_jobs processes in parallel. The new tags are added to the cache.
+    '''
+    descriptions = descriptions.astype(str)
+    hashes = pd.util.hash_pandas_object(descriptions, index=False).to_numpy()
+    cache = pd.read_parquet(tags_cache_path) if os.path.exists(tags_cache_path) else pd.DataFrame({'hash': np.array([], dtype=np.uint64), **{family: np.array([], dtype=np.uint64) for family in technologies}})
+    cache = cache.set_index('hash')
+
+    # tag each new description once
+    new = ~pd.Index(hashes).isin(cache.index)
+    new_descriptions = descriptions[new].drop_duplicates()
+    if len(new_descriptions):
+        chunks = [new_descriptions.iloc[i:i + chunksize] for i in range(0, len(new_descriptions), chunksize)]
+        if n_jobs > 1:
+            with Pool(n_jobs) as pool:
+                tags = pool.map(tag_descriptions, chunks)
+        else:
+            tags = [tag_descriptions(chunk) for chunk in chunks]
+        tags = pd.concat(tags)
+        tags.index = pd.util.hash_pandas_object(new_descriptions, index=False).to_numpy()
+        cache = pd.concat([cache, tags])
+        cache.rename_axis('hash').reset_index().to_parquet(tags_cache_path, index=False)
+
+    masks = cache.loc[hashes]
+    masks.index = descriptions.index
+    return masks
+
+
+def decode_tags(masks, family):
+    '''
+    This function takes the bitmasks of a family and returns a list of the technologies in each.
+    '''
+    names = technologies_bits[family]
+    bits = (masks.to_numpy(dtype=np.uint64)[:, None] >> np.arange(len(names), dtype=np.uint64)) & np.uint64(1)
+    return pd.Series([[names[i] for i in np.flatnonzero(row)] for row in bits], index=masks.index)
 
-    for i in range(len(ds)):
-        res = parse_description(ds.iloc[i]['description'])
-        if res['back_end'] == [] and res['front_end'] == [] and res['no_sql'] == [] and res['sql'] == []:
-            rows_to_be_removed.append(i)
-            continue
 
-        back_ends.append(res['back_end'])
-        front_ends.append(res['front_end'])
-        no_sqls.append(res['no_sql'])
-        sqls.append(res['sql'])
+def extend_dataset_with_frameworks(ds, n_jobs=1):
+    '''
+    This function takes a dataset and extends it with the frameworks used in the description of each job.
+    The descriptions are tagged by tag_dataset (n_jobs is passed to it).
+    '''
+    masks = tag_dataset(ds['description'], n_jobs)
 
-    ds = ds.drop(rows_to_be_removed)
+    # remove the rows that mention no technology
+    mentioned = (masks != 0).any(axis=1)
+    ds = ds[mentioned.to_numpy()].copy(deep=False)
+    masks = masks[mentioned]
 
-    ds['back_end'] = back_ends
-    ds['front_end'] = front_ends
-    ds['no_sql'] = no_sqls
-    ds['sql'] = sqls
+    for family in ['back_end', 'front_end', 'no_sql', 'sql']:
+        ds[family] = decode_tags(masks[family], family)
 
     return ds
 
 
+def get_one_hot(ds, tech):
+    '''
+    This function takes a dataset and a technology family and returns a sparse (rows x technologies) one-hot matrix of the technologies of each row and their names (most frequent first).
+    '''
+    lengths = ds[tech].str.len().to_numpy()
+    names = [t for row in ds[tech] for t in row]
+    counts = Counter(names)
+    labels = [t for t, count in counts.most_common()]
+    codes = pd.Index(labels).get_indexer(names)
+    rows = np.repeat(np.arange(len(ds)), lengths)
+    one_hot = sparse.csr_matrix((np.ones(len(names), dtype=np.int64), (rows, codes)), shape=(len(ds), len(labels)))
+    # a technology counts once per row
+    one_hot.data[:] = 1
+    return one_hot, labels
+
+
+def get_co_occurrence(ds, row_tech, col_tech, normalize=None, top_k_rows=None, top_k_cols=None):
+    '''
+    This function takes a dataset and two technology families and returns a dataframe with the number of rows mentioning each pair of their technologies (one sparse matrix product).
+    normalize can be 'lift' (the count over the count expected if they were independent) or 'pmi' (the log of the lift). top_k_rows and top_k_cols keep only the most frequent technologies of each axis.
+    '''
+    row_hot, row_labels = get_one_hot(ds, row_tech)
+    col_hot, col_labels = get_one_hot(ds, col_tech)
+    row_hot, row_labels = row_hot[:, :top_k_rows], row_labels[:top_k_rows]
+    col_hot, col_labels = col_hot[:, :top_k_cols], col_labels[:top_k_cols]
+
+    counts = (row_hot.T @ col_hot).toarray()
+    if normalize in ['lift', 'pmi']:
+        expected = np.outer(np.asarray(row_hot.sum(axis=0)).ravel(), np.asarray(col_hot.sum(axis=0)).ravel()) / max(len(ds), 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            counts = counts / expected
+            counts = np.log(counts) if normalize == 'pmi' else counts
+    return pd.DataFrame(counts, index=row_labels, columns=col_labels)
+
+
+# the number of set bits of each byte (to count the rows of a bitmap)
+bits_per_byte = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+
+def make_posting(rows, num_rows):
+    '''
+    This function takes the sorted row ids having a tag and returns its posting list in the smaller of two forms (like the containers of a roaring bitmap): ('array', the row ids as uint32) when the tag is rare
+    or ('bitmap', one bit per row packed in bytes) when it's common.
+    '''
+    if 4 * len(rows) < (num_rows + 7) // 8:
+        return ('array', np.asarray(rows, dtype=np.uint32))
+    bitmap = np.zeros(num_rows, dtype=bool)
+    bitmap[rows] = True
+    return ('bitmap', np.packbits(bitmap))
+
+
+def get_bitmap(posting, num_rows):
+    '''
+    This function takes a posting list (see make_posting) and returns it as a packed bitmap.
+    '''
+    kind, data = posting
+    if kind == 'bitmap':
+        return data
+    bitmap = np.zeros(num_rows, dtype=bool)
+    bitmap[data] = True
+    return np.packbits(bitmap)
+
+
+def get_union(postings, keys, num_rows):
+    '''
+    This function takes a dictionary of posting lists and some of its keys and returns the packed bitmap of the rows in any of them.
+    '''
+    bitmap = np.zeros((num_rows + 7) // 8, dtype=np.uint8)
+    for key in keys:
+        if key in postings:
+            bitmap = bitmap | get_bitmap(postings[key], num_rows)
+    return bitmap
+
+
+def get_postings(rows, values, num_rows):
+    '''
+    This function takes (row, value) pairs as two flat arrays and returns a dictionary from each value to its posting list (missing values have none).
+    '''
+    codes, labels = pd.factorize(pd.Series(values, dtype=object))
+    # missing values get the code -1
+    present = codes >= 0
+    rows, codes = np.asarray(rows)[present], codes[present]
+    # the pairs sorted by value then row so that the rows of each value are contiguous and sorted
+    order = np.lexsort((rows, codes))
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(labels)))])
+    rows = rows[order]
+    return {label: make_posting(np.unique(rows[start:end]), num_rows) for label, start, end in zip(labels, bounds[:-1], bounds[1:])}
+
+
+def build_tag_index(ds, families=('back_end', 'front_end', 'no_sql', 'sql'), languages_col='languagesUsed'):
+    '''
+    This function takes a dataset extended by extend_dataset_with_frameworks (and with the languagesUsed column of handle_languages_column) and returns an inverted index from each technology and language
+    to the positions of the rows having it, and from each year of createdAt and license to the positions of its rows. A tag used by several families (or as a language) points to the rows of any of them.
+    '''
+    num_rows = len(ds)
+    rows, tags = [], []
+    for family in families:
+        lengths = ds[family].str.len().to_numpy()
+        rows.append(np.repeat(np.arange(num_rows), lengths))
+        tags.extend(t for row in ds[family] for t in row)
+    if languages_col in ds.columns:
+        languages = ds[languages_col].astype(str).str.split(', ')
+        languages = languages.where(ds[languages_col].astype(str) != '', pd.Series([[]] * num_rows, index=ds.index))
+        rows.append(np.repeat(np.arange(num_rows), languages.str.len().to_numpy()))
+        tags.extend(t for row in languages for t in row)
+    rows = np.concatenate(rows) if rows else np.array([], dtype=np.int64)
+
+    positions = np.arange(num_rows)
+    # integer years (None where createdAt is missing)
+    years = pd.to_datetime(ds['createdAt'], utc=True).dt.year.astype('Int64').to_numpy(dtype=object, na_value=None)
+    return {
+        'num_rows': num_rows,
+        'tags': get_postings(rows, tags, num_rows),
+        'years': get_postings(positions, years, num_rows),
+        'licenses': get_postings(positions, ds['license'].astype(str).to_numpy(), num_rows),
+    }
+
+
+def query_index(index, query, years=None, licenses=None):
+    '''
+    This function takes an index of build_tag_index and a query and returns the packed bitmap of the rows matching it. A query is a tag or a tuple ('and', query, ...), ('or', query, ...) or ('not', query),
+    e.g. ('and', 'flask', 'postgresql') or ('and', 'vue', ('not', 'react')). years is an inclusive (first, last) range for the year of createdAt and licenses is a collection of licenses to keep.
+    '''
+    num_rows = index['num_rows']
+
+    def evaluate(query):
+        if isinstance(query, str):
+            return get_union(index['tags'], [query], num_rows)
+        op, *operands = query
+        bitmaps = [evaluate(operand) for operand in operands]
+        if op == 'and':
+            return np.bitwise_and.reduce(bitmaps)
+        if op == 'or':
+            return np.bitwise_or.reduce(bitmaps)
+        if op == 'not':
+            # the padding bits of the last byte stay unset
+            return np.packbits(np.unpackbits(~bitmaps[0], count=num_rows))
+        raise ValueError(f"Unknown operator {op}; expected 'and', 'or' or 'not'")
+
+    bitmap = evaluate(query)
+    if years is not None:
+        first, last = years
+        bitmap = bitmap & get_union(index['years'], [year for year in index['years'] if first <= year <= last], num_rows)
+    if licenses is not None:
+        bitmap = bitmap & get_union(index['licenses'], licenses, num_rows)
+    return bitmap
+
+
+def count_query(index, query, years=None, licenses=None):
+    '''
+    This function takes an index of build_tag_index and a query (see query_index) and returns the number of rows matching it.
+    '''
+    return int(bits_per_byte[query_index(index, query, years, licenses)].sum())
+
+
+def select_query(ds, index, query, years=None, licenses=None):
+    '''
+    This function takes the dataset an index was built from and a query (see query_index) and returns the rows matching it.
+    '''
+    bitmap = query_index(index, query, years, licenses)
+    return ds.iloc[np.flatnonzero(np.unpackbits(bitmap, count=index['num_rows']))]
+
+
 # get the top 3 frequent back-end frameworks
 def get_top_k_from_technology(ds, tech, k):
     '''
     This function takes a dataset and a technology and returns the top k most frequent frameworks used in the dataset.
     '''
-    tech_freq = Counter(t for row in ds[tech] for t in row)
-    top_k = [t for t, count in tech_freq.most_common(k)]
-    return top_k
+    _, labels = get_one_hot(ds, tech)
+    return labels[:k]
     
 
 
@@ -145,31 +353,12 @@ def get_front_ends_for_top_3_back_ends(ds):
     This function takes a dataset and returns a dictionary that maps each back end framework to its front end frameworks.
     '''
 
-    top_3_backend = get_top_k_from_technology(ds,'back_end', k=3)
-    
-    # create a dictionary that maps each back end framework to its front end frameworks and intialize it with the top 3 back end frameworks
+    # the front end frameworks that occur with each of the top 3 back end frameworks (most frequent first)
+    co_occurrence = get_co_occurrence(ds, 'back_end', 'front_end', top_k_rows=3)
     back_to_front = {}
-    for backend in top_3_backend:
-        back_to_front[backend] = []
-
-    for i in range(len(ds)):
-        for backend in ds.iloc[i]['back_end']:
-            if backend in back_to_front:
-                back_to_front[backend] += ds.iloc[i]['front_end']
-
-    # couting the frequency of each front end framework
-    def count_freq(lst):
-        freq = {}
-        for item in lst:
-            if item in freq:
-                freq[item] += 1
-            else:
-                freq[item] = 1
-        return freq
-    
-    for back_end in back_to_front:
-        back_to_front[back_end] = {k: v for k, v in sorted(count_freq(back_to_front[back_end]).items(), key=lambda item: item[1], reverse=True)}
-
+    for back_end, counts in co_occurrence.iterrows():
+        counts = counts[counts > 0].sort_values(ascending=False, kind='stable')
+        back_to_front[back_end] = {front_end: int(count) for front_end, count in counts.items()}
 
     return back_to_front 
 
@@ -181,25 +370,10 @@ def show_backend_databases_heatmap(ds):
     This function takes a dataset and shows a heatmap of the back end frameworks and the databases used with them.
     '''
 
-    # get the top 5 frequent back-end frameworks
-    backends = get_top_k_from_technology(ds,'back_end',5)
-    sqls     = get_top_k_from_technology(ds,'sql',5)
-    nosqls   = get_top_k_from_technology(ds,'no_sql',5)
-
-    sqls_counts = []
-    nosqls_counts = []
-
-    for sql in sqls:
-        for backend in backends:
-            sqls_counts.append(len(ds[ (ds['back_end'].apply(lambda x: backend in x)) & (ds['sql'].apply(lambda x: sql in x)) ]))        
-
-    for nosql in nosqls:
-        for backend in backends:
-            nosqls_counts.append(len(ds[ (ds['back_end'].apply(lambda x: backend in x)) & (ds['no_sql'].apply(lambda x: nosql in x)) ]))
-
-    # Create a numpy array of the frequency counts
-    sqls_counts = np.array(sqls_counts).reshape(5,5)
-    nosqls_counts = np.array(nosqls_counts).reshape(5,5)
+    # get the co-occurrences of the top 5 frequent sql and no-sql databases with the top 5 frequent back-end frameworks
+    sqls_counts = get_co_occurrence(ds, 'sql', 'back_end', top_k_rows=5, top_k_cols=5)
+    nosqls_counts = get_co_occurrence(ds, 'no_sql', 'back_end', top_k_rows=5, top_k_cols=5)
+    backends, sqls, nosqls = list(sqls_counts.columns), list(sqls_counts.index), list(nosqls_counts.index)
 
     # Create the heatmap using seaborn
     fig, ax = plt.subplots(figsize=(8, 6))
@@ -228,14 +402,8 @@ def explore_technology(ds, technology, title, top_n):
     This function takes a dataset, a technology, a title and the number of top frameworks to show and shows a pie chart of the top frameworks used in the dataset.
     '''
 
-    tech = []
-    for i in ds[technology]:
-        tech.extend(i)
-    tech = list(tech)
-
-    labels = set(tech)
-    sizes = [tech.count(i) for i in labels]
-    labels, sizes = zip(*sorted(zip(labels, sizes), key=lambda x: x[1], reverse=True))
+    one_hot, labels = get_one_hot(ds, technology)
+    sizes = np.asarray(one_hot.sum(axis=0)).ravel()
 
     plt.title(title)
     plt.pie(sizes[:top_n], labels = labels[:top_n], autopct='%1.1f%%', startangle=140)
@@ -1,6 +1,11 @@
 ### contains implementations for functions to be used (directly called) in the notebook
 
-def get_transactions(df):
-    transactions = df['languagesUsed'].tolist()
-    transactions = [x.split(',') for x in transactions]
+from DataPreparation.Preprocess import get_language_lists
+
+def get_transactions(df, lang_table):
+    '''
+    Returns the list of languages used by each repository in df where lang_table is the repo-language table of the
+    split df was read from (see read_language_table); they're joined by nameWithOwner so df must have it.
+    '''
+    transactions = get_language_lists(lang_table, df['nameWithOwner']).tolist()
     return transactions
\ No newline at end of file
@@ -2,8 +2,7 @@
 
 
 def preprocess_data(df):
-    data = df.copy()
-    data = data.drop(['stars', 'forks', 'watchers', 'isArchived', 'pullRequests', 'createdAt', 'defaultBranchCommitCount', 'assignableUserCount', 'codeOfConduct'], axis=1)
+    data = df.drop(['stars', 'forks', 'watchers', 'isArchived', 'pullRequests', 'createdAt', 'defaultBranchCommitCount', 'assignableUserCount', 'codeOfConduct'], axis=1)
 
     return data
     
@@ -21,7 +20,6 @@ def explore_primary_languages_and_sizes(df):
 import matplotlib.pyplot as plt
 
 def preprocess_data_for_plotting(df):
-    df = df.copy()
     df = df.dropna(subset=['license', 'diskUsageKb'])
     df = df[df['license'] != '-1']
     df = df[df['primaryLanguage'] != '-1']
@@ -114,7 +112,6 @@ def plot_project_size_with_language(df):
 
 def get_statistics_for_license_with_disk_usage(df):
     # get only rows with diskUsageKb > 30kb
-    new_df = df.copy()
     new_df = df[df['diskUsageKb'] > 10000]
 
     # get how many rows of them have license
@@ -127,8 +124,6 @@ def get_statistics_for_license_with_disk_usage(df):
 
     print('Percentage of repositories with license: ', percentage)
 
-    new_df = df.copy()
-
     # get only rows with diskUsageKb < 30kb & > 15kb
     new_df = df[df['diskUsageKb'] < 30]
     
@@ -152,7 +147,6 @@ def get_statistics_for_license_with_disk_usage(df):
 
     print(max_size)
     for i in range (max_size , 0 , -step):
-        new_df = df.copy()
         new_df = df[df['diskUsageKb'] > i]
         new_df = new_df[new_df['diskUsageKb'] < i + step]
         df_with_license = new_df[new_df['license'] != '-1']
@@ -303,15 +297,17 @@ def plot_project_size_with_license_with_language_3D(df):
     plt.show()
 
 
-def Plot_Correlation(df):
-    df = df.copy()
+from DataPreparation.Preprocess import stream_correlation
+
+def Plot_Correlation(df, chunksize=100_000):
     # get only diskUsageKb , primaryLanguage , license
     columns = ['diskUsageKb' , 'primaryLanguage' , 'license']
-    df = df[columns]
+    df = df[columns].copy()
     df['primaryLanguage'] = df['primaryLanguage'].astype('category').cat.codes
     df['license'] = df['license'].astype('category').cat.codes
     print(df.head())
-    corr = df.corr()
+    # exact correlation accumulated chunk by chunk
+    corr = stream_correlation((df.iloc[i:i + chunksize] for i in range(0, len(df), chunksize)), columns)
     print(corr)
     plt.style.use('dark_background')
     plt.figure(figsize=(10, 5))
@@ -1,40 +1,48 @@
 import matplotlib.pyplot as plt
 from matplotlib.patches import Circle
 import random
+import pandas as pd
+from DataPreparation.Preprocess import get_language_lists, build_cube, rollup
 
 dynamic_languages = ['Python', 'JavaScript', 'Ruby', 'PHP', 'Perl']
 static_languages = ['Java', 'C++', 'C#', 'Go', 'TypeScript']
 
 
-def preprocess_dataset(ds):
+def preprocess_dataset(ds, lang_table):
     '''
         This functions is responsible for two things:
-            1- dropping useless rows (i.e. primaryLanguage is '-1' and languaesUsed is empty string)
+            1- dropping useless rows (i.e. primaryLanguage is '-1' and languaesUsed is empty)
             2- parsing the languagesUsed column into a list of languages instead of string
-            3- if primaryLanguage is '-1' and languagesUsed is not empty string, then primaryLanguage is the first language in languagesUsed
-            4- if primaryLanguage is not '-1' and languagesUsed is empty string, then languagesUsed is a list containing only primaryLanguage
+            3- if primaryLanguage is '-1' and languagesUsed is not empty, then primaryLanguage is the first language in languagesUsed
+            4- if primaryLanguage is not '-1' and languagesUsed is empty, then languagesUsed is a list containing only primaryLanguage
+        The lists of languages come from lang_table; the repo-language table of the split ds was read from (see read_language_table)
+        joined by nameWithOwner (so ds must have it; it's dropped afterwards).
     '''
 
-    new_ds = ds.copy()
+    new_ds = ds.copy(deep=False)
 
     # make the createdAt column contains only the year
-    new_ds['year'] = new_ds['createdAt'].apply(lambda x: x.year)
-    new_ds['month'] = new_ds['createdAt'].apply(lambda x: x.month)
+    new_ds['year'] = new_ds['createdAt'].dt.year
+    new_ds['month'] = new_ds['createdAt'].dt.month
 
     # drop createdAt column
     new_ds = new_ds.drop('createdAt', axis=1)
 
-    # drop rows where primaryLanguage is '-1' and languagesUsed is empty string
-    new_ds = new_ds.drop(new_ds[(new_ds['primaryLanguage'] == '-1') & (new_ds['languagesUsed'] == '')].index)
+    # get the languagesUsed column as a list of languages instead of string
+    new_ds['languagesUsed'] = get_language_lists(lang_table, new_ds['nameWithOwner'])
+    new_ds = new_ds.drop('nameWithOwner', axis=1)
+    new_ds['primaryLanguage'] = new_ds['primaryLanguage'].astype(str)
+    has_langs = new_ds['languagesUsed'].str.len() > 0
 
-    # parse languagesUsed column into a list of languages instead of string
-    new_ds['languagesUsed'] = list(new_ds['languagesUsed'].apply(lambda x: x.split(', ')))
+    # drop rows where primaryLanguage is '-1' and languagesUsed is empty
+    new_ds = new_ds[(new_ds['primaryLanguage'] != '-1') | has_langs]
+    has_langs = has_langs[new_ds.index]
 
-    # if primaryLanguage is '-1' and languagesUsed is not empty string, then primaryLanguage is the first language in languagesUsed
-    new_ds.loc[(new_ds['primaryLanguage'] == '-1'), 'primaryLanguage'] = new_ds['languagesUsed'].apply(lambda x: x[0])
+    # if primaryLanguage is '-1' and languagesUsed is not empty, then primaryLanguage is the first language in languagesUsed
+    new_ds['primaryLanguage'] = new_ds['primaryLanguage'].where(new_ds['primaryLanguage'] != '-1', new_ds['languagesUsed'].str[0])
 
-    # if primaryLanguage is not '-1' and languagesUsed is a list of one element which is empty string
-    new_ds.loc[(new_ds['primaryLanguage'] != '-1') & (new_ds['languagesUsed'].apply(lambda x: len(x) == 1 and x[0] == '')), 'languagesUsed'] = new_ds['primaryLanguage'].apply(lambda x: [x])
+    # if primaryLanguage is not '-1' and languagesUsed is empty
+    new_ds['languagesUsed'] = new_ds['languagesUsed'].where(has_langs, new_ds['primaryLanguage'].apply(lambda x: [x]))
 
     return new_ds
 
@@ -188,6 +196,18 @@ def split_dataset_across_years_months(ds):
 
     return dynamic_datasets, static_datasets
 
+def get_usage_across_years_months(ds):
+    '''
+    Input: dataset
+    Output: two lists with the number of repositories of dynamic and static languages in each month of each year present in the dataset
+    (ordered by year then month); the counts of split_dataset_across_years_months rolled up from the aggregate cube of the dataset (see build_cube)
+    '''
+    cube = build_cube(ds)
+    months = pd.MultiIndex.from_product([sorted(cube['year'].unique()), range(1, 13)], names=['year', 'month'])
+    dynamic_usage = rollup(cube, ['year', 'month'], primaryLanguage=dynamic_languages)['count'].reindex(months, fill_value=0)
+    static_usage = rollup(cube, ['year', 'month'], primaryLanguage=static_languages)['count'].reindex(months, fill_value=0)
+    return dynamic_usage.tolist(), static_usage.tolist()
+
 
 def show_pie_chart_for_each_year(dynamic_datasets, static_datasets):
     '''
@@ -1,31 +1,27 @@
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
-def archival_overtime(x_data_d):
+from DataPreparation.Preprocess import build_cube, rollup, check_cube
+from DataPreparation.Forecast import fit_forecasters, backtest
+def archival_overtime(x_data_d, cube=None):
     '''
     For each year from 2009 to 2023 find the number and fraction of archivals for each language and return the result in a flat array.
+    The counts are rolled up from the aggregate cube of the data (see build_cube); pass it as cube if it's already built (e.g., by read_cube) for the same (unfiltered) data (see check_cube).
     '''
-    x_data_t = []
-    # Make a dataset for each year
-    for year in range(2009, 2023):
-        # Get the data for that year
-        x_data = x_data_d[x_data_d['year'] == year]
-        # Get the unique languages
-        langs = x_data['primaryLanguage'].unique()
-        if '-1' in langs: langs = langs[langs != '-1']
-        # For each language
-        for lang in langs:
-            # Get the data for that language
-            lang_data = x_data[x_data['primaryLanguage'] == lang]
-            # Get the number of repos in that language
-            num_lang_repos = len(lang_data)
-            # Get the number of repos in that language with isArchived = 1
-            num_archived_lang_repos = len(lang_data[lang_data['isArchived'] == 1])
-            # Get the fraction of repos in that language with isArchived = 1
-            frac_archived_lang_repos = num_archived_lang_repos / num_lang_repos
-            # Append the data to the 
-            x_data_t.append([year, lang, num_lang_repos, num_archived_lang_repos, frac_archived_lang_repos])
-    x_data_t = pd.DataFrame(x_data_t, columns=['year', 'language', 'num_lang_repos', 'num_archived_lang_repos', 'frac_archived_lang_repos'])
+    if cube is None:
+        cube = build_cube(x_data_d)
+    else:
+        check_cube(cube, x_data_d)
+    x_data_t = rollup(cube, ['year', 'primaryLanguage'], year=range(2009, 2023))
+    x_data_t = x_data_t.reset_index()
+    x_data_t = x_data_t[(x_data_t['primaryLanguage'] != '-1') & (x_data_t['count'] > 0)]
+    x_data_t = pd.DataFrame({
+        'year': x_data_t['year'].to_numpy(dtype='int64'),
+        'language': x_data_t['primaryLanguage'].astype(str).to_numpy(),
+        'num_lang_repos': x_data_t['count'].to_numpy(),
+        'num_archived_lang_repos': x_data_t['archived'].to_numpy(),
+        'frac_archived_lang_repos': x_data_t['archived'].to_numpy() / x_data_t['count'].to_numpy(),
+    })
     return x_data_t
 
 
@@ -72,28 +68,10 @@ def plot_most_archived_per_year(x_data_t):
 
 def archival_overtime_given_lang(x_data_d, lang, unit='month'):
     '''
-    Find the yearly or monthly number of archives for a given language
+    Find the yearly or monthly number of archives for a given language (the monthly ones are a slice of build_archival_panel)
     '''
     if unit == 'month':
-        x_data_t = []
-        # Make a dataset for each year
-        for year in range(2009, 2023):
-            x_data = x_data_d[x_data_d['year'] == year]
-            for month in range(1, 13):
-                x_data_m = x_data[x_data['month'] == month]            
-                # Get the rows with the language
-                x_data_m = x_data_m[x_data_m['primaryLanguage'] == lang]
-                # Count the number of archives
-                num_archives = len(x_data_m[x_data_m['isArchived'] == 1])
-                # Count the number of repos
-                num_repos = len(x_data_m)
-                if len(x_data_m) == 0:    
-                    frac_archives = 0
-                # Append the data to the list
-                else:
-                    frac_archives = num_archives / num_repos
-                x_data_t.append([year, month, num_archives, num_repos, frac_archives])
-        return pd.DataFrame(x_data_t, columns=['year', 'month', 'num_archives', 'num_repos', 'frac_archives'])
+        return get_language_series(build_archival_panel(x_data_d, [lang]), lang)
     else:
         x_data_t = []
         # Make a dataset for each year
@@ -112,12 +90,50 @@ def archival_overtime_given_lang(x_data_d, lang, unit='month'):
 
 
 
+def build_archival_panel(x_data_d, languages=None, years=range(2009, 2023)):
+    '''
+    Build the monthly archivals of many languages at once in a single bincount pass: a dictionary with the languages (all but '-1' by default), the months
+    of the given years and languages x months arrays of the number of repos (num_repos), of archived repos (num_archives) and their fraction (frac_archives; 0 for months without repos).
+    '''
+    if languages is None:
+        languages = sorted(set(x_data_d['primaryLanguage'].astype(str).unique()) - {'-1'})
+    languages = pd.Index(languages)
+    months = pd.date_range(f'{years[0]}-01-01', f'{years[-1]}-12-01', freq='MS')
+
+    # the cell of each repo (-1 if its language or year is not in the panel)
+    lang_codes = languages.get_indexer(x_data_d['primaryLanguage'].astype(str))
+    month_codes = (x_data_d['year'].to_numpy() - years[0]) * 12 + x_data_d['month'].to_numpy() - 1
+    valid = (lang_codes >= 0) & (month_codes >= 0) & (month_codes < len(months))
+    cells = lang_codes[valid] * len(months) + month_codes[valid]
+
+    shape = (len(languages), len(months))
+    num_repos = np.bincount(cells, minlength=shape[0] * shape[1]).reshape(shape)
+    num_archives = np.bincount(cells, weights=x_data_d['isArchived'].to_numpy()[valid], minlength=shape[0] * shape[1]).reshape(shape).astype(np.int64)
+    frac_archives = np.divide(num_archives, num_repos, out=np.zeros(shape), where=num_repos > 0)
+    return {'languages': languages, 'months': months, 'num_repos': num_repos, 'num_archives': num_archives, 'frac_archives': frac_archives}
+
+
+def get_language_series(panel, lang):
+    '''
+    Slice the monthly archivals of a language out of a panel of build_archival_panel as a dataframe indexed by year_month (what train_test_timesplit and plot_archivals_per_month take)
+    '''
+    i = panel['languages'].get_loc(lang)
+    months = panel['months'].rename('year_month')
+    return pd.DataFrame({
+        'year': months.year,
+        'month': months.month,
+        'num_archives': panel['num_archives'][i],
+        'num_repos': panel['num_repos'][i],
+        'frac_archives': panel['frac_archives'][i],
+    }, index=months)
+
+
 # Make a plot for the number of archivals per month for python vs year-month
 def plot_archivals_per_month(x_data_lang, lang_name, k=None):
     '''
     Plot the number of archivals per month for python vs year-month for the last k years
     '''
-    x_data_p = x_data_lang.copy()
+    x_data_p = x_data_lang.copy(deep=False)
     if k is not None:
         x_data_p['year-month'] = x_data_p['year'].astype(str) + '-' + x_data_p['month'].astype(str)
         x_data_p = x_data_p[x_data_p['year'] >= 2023 - k]
@@ -155,9 +171,10 @@ def plot_archivals_per_month(x_data_lang, lang_name, k=None):
 
 def train_test_timesplit(x_data_lang, split_date='2021-01-01'):
 
-    # set 'year_month' column as the index
-    x_data_lang['year_month'] = pd.to_datetime(x_data_lang['year'].astype(str) + '-' + x_data_lang['month'].astype(str))
-    x_data_lang = x_data_lang.set_index('year_month')
+    # set 'year_month' column as the index (slices of build_archival_panel have it already)
+    if not isinstance(x_data_lang.index, pd.DatetimeIndex):
+        x_data_lang['year_month'] = pd.to_datetime(x_data_lang['year'].astype(str) + '-' + x_data_lang['month'].astype(str))
+        x_data_lang = x_data_lang.set_index('year_month')
     
     # keep only the 'year', 'month', and 'frac_archives' columns
     x_data_lang = x_data_lang[['year', 'month', 'frac_archives']]
@@ -180,6 +197,32 @@ def train_test_timesplit(x_data_lang, split_date='2021-01-01'):
     return x_train, y_train, x_val, y_val
 
 
+# the hyperparameters of the forecaster of each language
+FORECASTER_PARAMS = {'booster': 'gbtree', 'max_depth': 5, 'gamma': 0.00015}
+
+
+def train_languages(panel, languages, split_date='2021-01-01', params=FORECASTER_PARAMS, n_jobs=None):
+    '''
+    Train a forecaster of the monthly fraction of archivals of each language (sliced from a panel of build_archival_panel and split by train_test_timesplit) in parallel by n_jobs processes
+    and return the lang_preds that plot_timeperformance takes (with the model of each language). Languages whose data and hyperparameters didn't change are loaded from the cache of fit_forecasters.
+    '''
+    tasks = {lang: train_test_timesplit(get_language_series(panel, lang), split_date) for lang in languages}
+    return fit_forecasters(tasks, params, n_jobs)
+
+
+
+def backtest_languages(panel, languages, n_folds=3, horizon=12, params=FORECASTER_PARAMS, n_jobs=None):
+    '''
+    Backtest the forecaster of the monthly fraction of archivals of each language over n_folds expanding windows of horizon months (see backtest) instead of the single split of
+    train_test_timesplit and return the results in the structure plot_timeperformance takes (their RMSEs per fold are tabulated by get_backtest_table).
+    '''
+    series = {}
+    for lang in languages:
+        x_data_lang = get_language_series(panel, lang)
+        series[lang] = (x_data_lang[['year', 'month']], x_data_lang['frac_archives'])
+    return backtest(series, n_folds, horizon, params, n_jobs)
+
+
 # Let's make a plot of 6 columns and as much rows as needed
 def plot_timeperformance(lang_preds, susp_list):
     '''
@@ -1,13 +1,13 @@
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
+from DataPreparation.Preprocess import resample_metric
 color_pal = sns.color_palette()
 def preprocess_data(df):
     """
     This function returns all repos with python as primary language, the pushed data of the repo, 
     and the number of pull requests for the repo.
     """
-    df = df.copy()
     df = df[df['primaryLanguage'] == 'Python']
     df = df[['primaryLanguage', 'pushedAt', 'pullRequests']]
     # df = df[['primaryLanguage', 'createdAt', 'pullRequests']]
@@ -37,39 +37,30 @@ def preprocess_data(df):
 
     return df
 
-def explore_data(df):
+def explore_data(df, metric='pullRequests'):
     print("Number of repos with python as primary language: ", df.shape[0])
     print("Available years from {} to {}".format(df['year'].min(), df['year'].max()))
 
-    print("Number of pull requests over all python repos from 2009 to 2022: ", df['pullRequests'].sum())
-    pullReqs = []
-    date = []
-    for year in range(df['year'].min(), df['year'].max() + 1):
-        print("Number of pull requests in {}: {}".format(year, df[df['year'] == year]['pullRequests'].sum()))
-        pullReqs.append(df[df['year'] == year]['pullRequests'].sum())
-        date.append(str(year))
-    pullReqsMonth = []
-    dateMonth = []
-
-    for year in range(df['year'].min(), df['year'].max() + 1):
-        for month in range(1, 13):
-            # print("Number of pull requests in {}-{}: {}".format(year, month, df[(df['year'] == year) & (df['month'] == month)]['pullRequests'].sum()))
-            num = df[(df['year'] == year) & (df['month'] == month)]['pullRequests'].sum()
-            if num != 0:
-                pullReqsMonth.append(num)
-                dateMonth.append(str(year) + '-' + str(month))
-               
-
-
-    draw_bar_plot(pullReqs, date)
+    print("Number of pull requests over all python repos from 2009 to 2022: ", df[metric].sum())
+    # the sums of each year and month in one pass each
+    years = range(df['year'].min(), df['year'].max() + 1)
+    pullReqs = df.groupby('year')[metric].sum().reindex(years, fill_value=0)
+    for year, num in pullReqs.items():
+        print("Number of pull requests in {}: {}".format(year, num))
+    date = [str(year) for year in years]
+
+    # the months of the years and months kept by preprocess_data (months without pull requests are dropped)
+    months = pd.to_datetime(df[['year', 'month']].assign(day=1))
+    df_time_series = resample_metric(df.assign(Date=months), metric, time_col='Date', freq='MS')
+
+    draw_bar_plot(list(pullReqs), date)
     
 
-    for i in range(1,20):
-        print("Number of pull requests in {}-{}: {}".format(dateMonth[-i].split('-')[0], dateMonth[-i].split('-')[1], pullReqsMonth[-i]))   
+    for month, num in df_time_series[metric].iloc[:-20:-1].items():
+        print("Number of pull requests in {}-{}: {}".format(month.year, month.month, num))   
     
     # create dataframe for time series
-    df_time_series = pd.DataFrame({'Date': pd.to_datetime(dateMonth), 'PullRequests': pullReqsMonth})
-    df_time_series.set_index('Date', inplace=True)
+    df_time_series.columns = ['PullRequests']
 
     return df_time_series
 
@@ -104,7 +95,7 @@ def split_data(df):
 
 
 def create_features(df): 
-    df = df.copy()
+    df = df.copy(deep=False)
     df['year'] = df.index.year
     df['month'] = df.index.month
     return df
@@ -126,11 +117,22 @@ def plot_train_test(train , test):
 
 import xgboost as xgb
 from sklearn.metrics import mean_squared_error
+from DataPreparation.Forecast import fit_forecasters, backtest
+
+MODEL_PARAMS = {'n_estimators': 10000 , 'early_stopping_rounds': 50 , 'learning_rate': 0.001}
 
 def train_model(X_train , y_train , X_test , y_test):
-    reg = xgb.XGBRegressor(n_estimators=10000 , early_stopping_rounds=50 , learning_rate=0.001)
-    reg.fit(X_train , y_train , eval_set=[(X_train , y_train) , (X_test , y_test)] , verbose=100)
-    return reg
+    # the fitted model is cached so re-running the notebook on the same data loads it instead of fitting it again
+    fits = fit_forecasters({'python': (X_train , y_train , X_test , y_test)} , MODEL_PARAMS , n_jobs=1 , verbose=100)
+    return fits['python']['model']
+
+def backtest_model(df_time_series , n_folds=3 , horizon=12 , n_jobs=None):
+    """
+    This function backtests the model over n_folds expanding windows of horizon months (see backtest) instead of the single split of split_data
+    and returns the results in the structure plot_timeperformance takes.
+    """
+    df = create_features(df_time_series)
+    return backtest({'python': (df[['year' , 'month']] , df['PullRequests'])} , n_folds , horizon , MODEL_PARAMS , n_jobs)
 
 
 